@@ -2,15 +2,23 @@ from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 import gitmodule
+from visualization.backend.services import cochange, hotspots
+from visualization.backend.services.workers import run_git
+from intervals import IntervalIndexCache
 import os
+from pathlib import Path
 
 app = FastAPI(title="Git Analysis API")
 
+# индекс сущностей из БД индексатора (runner.py): файл + строка -> диапазон функции
+entity_index = IntervalIndexCache(os.getenv("INDEX_DB_PATH", "db.sqlite"))
+
 class FileAnalysisRequest(BaseModel):
     repo_path: str
     file_path: str
-    start_line: int
-    end_line: int
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    line: Optional[int] = None  # вместо start_line/end_line: любая строка внутри функции
     max_commits: int = 3
     max_coupled: int = 10
     max_recommendations: int = 5
@@ -22,53 +30,200 @@ class FileAnalysisResponse(BaseModel):
 
 @app.post("/analyze", response_model=FileAnalysisResponse)
 async def analyze_file(request: FileAnalysisRequest):
+    # blame и diff блокируют, поэтому весь анализ идёт в пуле потоков
+    return await run_git(_analyze_file, request)
+
+def _analyze_file(request: FileAnalysisRequest) -> FileAnalysisResponse:
+    if request.start_line is None or request.end_line is None:
+        if request.line is None:
+            raise HTTPException(status_code=422, detail="Specify start_line and end_line, or line")
+        found = entity_index.enclosing(os.path.join(request.repo_path, request.file_path), request.line)
+        if found is None:
+            raise HTTPException(status_code=404, detail="No indexed function or class encloses the specified line")
+        request.start_line, request.end_line, _ = found
+
     try:
         # Get repository
-        repo = gitmodule.get_repo(request.repo_path)
+        with gitmodule.checkout_repo(request.repo_path) as repo:
         
-        # Get commit IDs for the specified lines
-        commit_ids = gitmodule.get_commit_ids_for_lines(
-            repo,
-            request.file_path,
-            request.start_line,
-            request.end_line
-        )
+            # Get commit IDs for the specified lines
+            commit_ids = gitmodule.get_commit_ids_for_lines(
+                repo,
+                request.file_path,
+                request.start_line,
+                request.end_line
+            )
         
-        if not commit_ids:
-            raise HTTPException(status_code=404, detail="No commits found for the specified lines")
+            if not commit_ids:
+                raise HTTPException(status_code=404, detail="No commits found for the specified lines")
         
-        # Get commit metadata
-        commits_meta = gitmodule.get_information_for_commits(repo, commit_ids)
+            # Get commit metadata
+            commits_meta = gitmodule.get_information_for_commits(repo, commit_ids)
         
-        # Compute coupling
-        coupling = gitmodule.compute_coupling(
-            commits_meta,
-            request.file_path,
-            top_n=request.max_coupled
-        )
+            # Compute coupling: по всей истории из матрицы co-change, пока она строится — по коммитам blame
+            coupling = cochange.coupling_for(repo, request.file_path, top_n=request.max_coupled)
+            if coupling is None:
+                coupling = gitmodule.compute_coupling(
+                    commits_meta,
+                    request.file_path,
+                    top_n=request.max_coupled
+                )
         
-        # Build LLM prompt
-        target = {
-            "file": request.file_path,
-            "start": request.start_line,
-            "end": request.end_line
-        }
+            # Build LLM prompt
+            target = {
+                "file": request.file_path,
+                "start": request.start_line,
+                "end": request.end_line
+            }
         
-        llm_prompt = gitmodule.build_llm_prompt(
-            target,
-            commits_meta,
-            coupling,
-            max_commits=request.max_commits,
-            max_coupled=request.max_coupled,
-            max_recommendations=request.max_recommendations
-        )
+            llm_prompt = gitmodule.build_llm_prompt(
+                target,
+                commits_meta,
+                coupling,
+                max_commits=request.max_commits,
+                max_coupled=request.max_coupled,
+                max_recommendations=request.max_recommendations
+            )
         
-        return FileAnalysisResponse(
-            commits=commits_meta,
-            coupling=coupling,
-            llm_prompt=llm_prompt
-        )
+            return FileAnalysisResponse(
+                commits=commits_meta,
+                coupling=coupling,
+                llm_prompt=llm_prompt
+            )
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class LineRange(BaseModel):
+    start_line: int
+    end_line: int
+
+class BatchAnalysisRequest(BaseModel):
+    repo_path: str
+    file_path: str
+    ranges: Optional[List[LineRange]] = None  # если не заданы — все сущности файла из БД индексатора
+    max_commits: int = 3
+    max_coupled: int = 10
+    max_recommendations: int = 5
+
+class RangeAnalysis(BaseModel):
+    start_line: int
+    end_line: int
+    entity_id: Optional[str] = None
+    commits: List[dict]
+    coupling: List[dict]
+    llm_prompt: str
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[RangeAnalysis]
+
+@app.post("/analyze-batch", response_model=BatchAnalysisResponse)
+async def analyze_batch(request: BatchAnalysisRequest):
+    return await run_git(_analyze_batch, request)
+
+def _analyze_batch(request: BatchAnalysisRequest) -> BatchAnalysisResponse:
+    if request.ranges is not None:
+        targets = [(r.start_line, r.end_line, None) for r in request.ranges]
+    else:
+        file_uri = Path(request.repo_path, request.file_path).resolve().as_uri()
+        index = entity_index.get(file_uri)
+        targets = list(zip(index.starts, index.ends, index.ids))
+        if not targets:
+            raise HTTPException(status_code=404, detail="No indexed entities in the specified file")
+
+    try:
+        with gitmodule.checkout_repo(request.repo_path) as repo:
+
+            # один blame на весь файл, дальше нарезка по диапазонам
+            ranges_commits = gitmodule.get_commit_ids_for_ranges(
+                repo,
+                request.file_path,
+                [(start, end) for start, end, _ in targets]
+            )
+
+            # метаданные каждого коммита достаём один раз на все диапазоны
+            all_shas = {sha for commit_ids in ranges_commits for sha in commit_ids}
+            meta_by_sha = {
+                meta["sha"]: meta
+                for meta in gitmodule.get_information_for_commits(repo, list(all_shas))
+            }
+
+            # coupling по матрице считается на файл, а не на диапазон
+            file_coupling = cochange.coupling_for(repo, request.file_path, top_n=request.max_coupled)
+
+            results = []
+            for (start, end, entity_id), commit_ids in zip(targets, ranges_commits):
+                commits_meta = [meta_by_sha[sha] for sha in commit_ids]
+                coupling = file_coupling
+                if coupling is None:
+                    coupling = gitmodule.compute_coupling(commits_meta, request.file_path, top_n=request.max_coupled)
+                llm_prompt = gitmodule.build_llm_prompt(
+                    {"file": request.file_path, "start": start, "end": end},
+                    commits_meta,
+                    coupling,
+                    max_commits=request.max_commits,
+                    max_coupled=request.max_coupled,
+                    max_recommendations=request.max_recommendations
+                )
+                results.append(RangeAnalysis(
+                    start_line=start,
+                    end_line=end,
+                    entity_id=entity_id,
+                    commits=commits_meta,
+                    coupling=coupling,
+                    llm_prompt=llm_prompt
+                ))
+
+            return BatchAnalysisResponse(results=results)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class HotspotRequest(BaseModel):
+    repo_path: str
+    file_path: Optional[str] = None  # если задан — метрики по функциям этого файла
+    top_n: int = 20
+    half_life_days: float = hotspots.DEFAULT_HALF_LIFE_DAYS
+    order_by: str = "score"
+
+class HotspotResponse(BaseModel):
+    files: List[dict]
+    functions: List[dict]
+
+@app.post("/hotspots", response_model=HotspotResponse)
+async def hotspot_report(request: HotspotRequest):
+    return await run_git(_hotspot_report, request)
+
+def _hotspot_report(request: HotspotRequest) -> HotspotResponse:
+    try:
+        with gitmodule.checkout_repo(request.repo_path) as repo:
+            table = hotspots.load_history(repo)
+            files = hotspots.file_hotspots(
+                table,
+                top_n=request.top_n,
+                half_life_days=request.half_life_days,
+                order_by=request.order_by
+            )
+
+            functions = []
+            if request.file_path is not None:
+                index = entity_index.get(Path(request.repo_path, request.file_path).resolve().as_uri())
+                ranges = list(zip(index.starts, index.ends))
+                ranges_commits = gitmodule.get_commit_ids_for_ranges(repo, request.file_path, ranges)
+                functions = hotspots.function_hotspots(
+                    table,
+                    [(ent_id, start, end, shas) for (start, end), ent_id, shas in zip(ranges, index.ids, ranges_commits)],
+                    half_life_days=request.half_life_days
+                )[:request.top_n]
+
+            return HotspotResponse(files=files, functions=functions)
+
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,65 @@
+"""
+Сравнение памяти: ParsedEntity против прежних вложенных словарей.
+
+Разбирает все .py-файлы корпуса (по умолчанию — стандартную библиотеку),
+затем под tracemalloc восстанавливает оба представления из pickle
+(pickle сохраняет разделяемые объекты, то есть и интернирование)
+и сравнивает занятую память.
+
+    python -m benchmarks.entity_memory [root] [--limit N]
+"""
+import argparse
+import ast
+import gc
+import pickle
+import tracemalloc
+from pathlib import Path
+
+from parsers.parse_python import parse_python
+
+
+def parse_corpus(root: Path, limit: int):
+    entities = []
+    files = 0
+    for path in sorted(root.rglob("*.py")):
+        try:
+            entities.extend(parse_python(path.resolve()))
+        except (SyntaxError, UnicodeDecodeError, ValueError):
+            continue
+        files += 1
+        if limit and files >= limit:
+            break
+    return files, entities
+
+
+def measure(payload: bytes):
+    gc.collect()
+    tracemalloc.start()
+    data = pickle.loads(payload)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", nargs="?", default=str(Path(ast.__file__).parent))
+    parser.add_argument("--limit", type=int, default=0, help="Максимум файлов (0 — все)")
+    args = parser.parse_args()
+
+    files, entities = parse_corpus(Path(args.root), args.limit)
+
+    slotted, slotted_bytes = measure(pickle.dumps(entities))
+    # прежнее представление: каждая сущность — словарь с полными URI в id и methods
+    dicts, dict_bytes = measure(pickle.dumps([e.to_dict() for e in entities]))
+
+    print(f"files:       {files}")
+    print(f"entities:    {len(slotted)}")
+    print(f"dicts:       {dict_bytes / 2**20:8.1f} MiB  ({dict_bytes / len(dicts):.0f} B/entity)")
+    print(f"slotted:     {slotted_bytes / 2**20:8.1f} MiB  ({slotted_bytes / len(slotted):.0f} B/entity)")
+    print(f"reduction:   {dict_bytes / slotted_bytes:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
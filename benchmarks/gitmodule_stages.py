@@ -0,0 +1,232 @@
+"""
+Бенчмарк этапов gitmodule на сгенерированных репозиториях.
+
+Генератор детерминированно (по --seed) строит через pygit2 bare-репозиторий:
+--files файлов по --lines строк, --commits коммитов, каждый меняет --fanout
+файлов. Файлы разбиты на --groups групп; с вероятностью --affinity файл
+коммита берётся из «своей» группы, так что у coupling есть структура.
+
+Замеряются get_commit_ids_for_lines (холодный и из кеша),
+get_commit_ids_for_ranges, fetch_commit (холодный и из кеша),
+get_information_for_commits и compute_coupling: время на операцию,
+операций в секунду и пик памяти Python (tracemalloc).
+
+    python -m benchmarks.gitmodule_stages [--commits 500 2000] [--lines 200 2000] [--fanout 3]
+
+Для --commits, --files, --lines и --fanout можно передать несколько значений:
+прогоняется их декартово произведение.
+"""
+import argparse
+import itertools
+import logging
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import pygit2
+
+import gitmodule
+
+BASE_TIME = 1_700_000_000
+
+
+def generate_repo(
+    path: str,
+    commits: int,
+    files: int,
+    lines: int,
+    fanout: int,
+    groups: int = 8,
+    affinity: float = 0.8,
+    authors: int = 5,
+    seed: int = 0,
+) -> pygit2.Repository:
+    """
+    Детерминированный репозиторий: файлы g<группа>/f<номер>.py, в каждом коммите
+    меняется fanout файлов (несколько случайных строк в каждом).
+    """
+    rng = random.Random(seed)
+    repo = pygit2.init_repository(path, bare=True)
+
+    names = [f"g{i % groups}/f{i}.py" for i in range(files)]
+    by_group: Dict[str, List[str]] = {}
+    for name in names:
+        by_group.setdefault(name.split("/")[0], []).append(name)
+    contents = {name: [f"x_{i} = {i}" for i in range(lines)] for name in names}
+
+    # поддеревья пересобираются только для тронутых групп
+    blobs = {name: repo.create_blob(("\n".join(text) + "\n").encode()) for name, text in contents.items()}
+    subtrees: Dict[str, pygit2.Oid] = {}
+
+    def write_group(group: str):
+        builder = repo.TreeBuilder()
+        for name in by_group[group]:
+            builder.insert(name.split("/")[1], blobs[name], pygit2.GIT_FILEMODE_BLOB)
+        subtrees[group] = builder.write()
+
+    def write_root() -> pygit2.Oid:
+        builder = repo.TreeBuilder()
+        for group, oid in subtrees.items():
+            builder.insert(group, oid, pygit2.GIT_FILEMODE_TREE)
+        return builder.write()
+
+    for group in by_group:
+        write_group(group)
+
+    parents: List[pygit2.Oid] = []
+    group_names = sorted(by_group)
+    for c in range(commits):
+        home = by_group[rng.choice(group_names)]
+        touched = set()
+        while len(touched) < min(fanout, files):
+            pool = home if rng.random() < affinity else names
+            touched.add(rng.choice(pool))
+
+        for name in touched:
+            text = contents[name]
+            for _ in range(rng.randint(1, 5)):
+                text[rng.randrange(lines)] = f"x = {c}_{rng.randrange(1 << 30)}"
+            blobs[name] = repo.create_blob(("\n".join(text) + "\n").encode())
+        for group in {name.split("/")[0] for name in touched}:
+            write_group(group)
+
+        author = c % authors
+        sig = pygit2.Signature(f"dev{author}", f"dev{author}@example.com", BASE_TIME + c * 3600, 0)
+        oid = repo.create_commit("refs/heads/master", sig, sig, f"change {c}", write_root(), parents)
+        parents = [oid]
+    return repo
+
+
+def measure(label: str, fn: Callable[[], None], ops: int) -> Dict:
+    """
+    fn выполняет ops операций; возвращает время на операцию и пик памяти Python.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    row = {
+        "stage": label,
+        "ms_per_op": elapsed / ops * 1e3,
+        "ops_per_s": ops / elapsed if elapsed else float("inf"),
+        "peak_kb": peak / 1024,
+    }
+    print(f"  {label:28s} {row['ms_per_op']:9.3f} ms/op {row['ops_per_s']:10.1f} op/s {row['peak_kb']:10.1f} KiB peak")
+    return row
+
+
+def bench_repo(repo: pygit2.Repository, lines: int, samples: int, seed: int = 1) -> List[Dict]:
+    rng = random.Random(seed)
+    head = repo.revparse_single("HEAD").peel(pygit2.Commit)
+    paths = [f"{entry.name}/{blob.name}" for entry in head.tree for blob in entry]
+
+    ranges: List[Tuple[str, int, int]] = []
+    for _ in range(samples):
+        start = rng.randint(1, lines)
+        ranges.append((rng.choice(paths), start, min(lines, start + rng.randint(0, 40))))
+    target = ranges[0][0]
+    file_ranges = [(start, end) for _, start, end in ranges]
+
+    gitmodule.blame_cache.clear()
+    gitmodule.commit_cache.clear()
+    results: Dict[str, Sequence] = {}
+
+    def blame_cold():
+        gitmodule.blame_cache.clear()
+        results["shas"] = [gitmodule.get_commit_ids_for_lines(repo, path, start, end) for path, start, end in ranges]
+
+    def blame_warm():
+        for path, start, end in ranges:
+            gitmodule.get_commit_ids_for_lines(repo, path, start, end)
+
+    def blame_batch():
+        gitmodule.blame_cache.clear()
+        gitmodule.get_commit_ids_for_ranges(repo, target, file_ranges)
+
+    rows = [
+        measure("get_commit_ids_for_lines", blame_cold, samples),
+        measure("  (cached)", blame_warm, samples),
+        measure("get_commit_ids_for_ranges", blame_batch, samples),
+    ]
+    all_shas = sorted({sha for shas in results["shas"] for sha in shas})
+    if not all_shas:
+        return rows
+
+    def fetch_cold():
+        gitmodule.commit_cache.clear()
+        for sha in all_shas:
+            gitmodule.fetch_commit(repo, sha)
+
+    def fetch_warm():
+        for sha in all_shas:
+            gitmodule.fetch_commit(repo, sha)
+
+    def fetch_hunks():
+        gitmodule.commit_cache.clear()
+        for sha in all_shas:
+            gitmodule.fetch_commit(repo, sha, target_file=target)
+
+    def information():
+        gitmodule.commit_cache.clear()
+        results["meta"] = [gitmodule.get_information_for_commits(repo, shas) for shas in results["shas"]]
+
+    def coupling():
+        for (path, _, _), meta in zip(ranges, results["meta"]):
+            gitmodule.compute_coupling(meta, path)
+
+    rows += [
+        measure("fetch_commit", fetch_cold, len(all_shas)),
+        measure("  (cached)", fetch_warm, len(all_shas)),
+        measure("fetch_commit + hunks", fetch_hunks, len(all_shas)),
+        measure("get_information_for_commits", information, samples),
+        measure("compute_coupling", coupling, samples),
+    ]
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commits", type=int, nargs="+", default=[500])
+    parser.add_argument("--files", type=int, nargs="+", default=[100])
+    parser.add_argument("--lines", type=int, nargs="+", default=[300])
+    parser.add_argument("--fanout", type=int, nargs="+", default=[3])
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--affinity", type=float, default=0.8)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", help="Directory to keep generated repositories in")
+    args = parser.parse_args()
+
+    # gitmodule пишет INFO на каждый вызов
+    logging.getLogger(gitmodule.__name__).setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(args.keep or tmp)
+        for commits, files, lines, fanout in itertools.product(args.commits, args.files, args.lines, args.fanout):
+            path = root / f"repo_c{commits}_f{files}_l{lines}_k{fanout}_s{args.seed}.git"
+            start = time.perf_counter()
+            if path.exists():
+                repo = pygit2.Repository(str(path))
+            else:
+                repo = generate_repo(
+                    str(path), commits, files, lines, fanout,
+                    groups=args.groups, affinity=args.affinity, seed=args.seed,
+                )
+            print(
+                f"commits={commits} files={files} lines={lines} fanout={fanout}"
+                f" (generated in {time.perf_counter() - start:.1f}s)"
+            )
+            bench_repo(repo, lines, args.samples)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"max RSS {rss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Бенчмарк запросов queries.py на синтетической БД с миллионом рёбер.
+
+    python -m benchmarks.graph_queries [--entities N] [--edges M] [--no-index]
+
+--no-index удаляет вторичные индексы после загрузки, чтобы сравнить
+с полным сканированием таблиц.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+
+import queries
+from storage import Base, init_db
+
+SAMPLES = 200
+
+
+def build(db_path: str, n_entities: int, n_edges: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = [f"f{i}" for i in range(n_entities)]
+    ids = [f"file:///bench/m{i % 1000}.py::{name}" for i, name in enumerate(names)]
+
+    engine = init_db(db_path)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO entities (id, name, type, file, start_line, start_char, end_line, end_char, comments)"
+            " VALUES (?, ?, 'function', ?, 0, 0, 0, 0, '[]')",
+            [(ent_id, name, ent_id.split("::")[0]) for ent_id, name in zip(ids, names)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO calls (caller_id, callee_id) VALUES (?, ?)",
+            [(rng.choice(ids), rng.choice(names)) for _ in range(n_edges)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO methods (class_id, method_id) VALUES (?, ?)",
+            [(rng.choice(ids), rng.choice(ids)) for _ in range(n_edges // 20)],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO inherits (child_id, parent_id) VALUES (?, ?)",
+            [(rng.choice(ids), rng.choice(names)) for _ in range(n_edges // 50)],
+        )
+    return ids, names
+
+
+def drop_indexes(db_path: str):
+    with init_db(db_path).begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+
+def bench(label: str, fn, args_list):
+    start = time.perf_counter()
+    rows = 0
+    for args in args_list:
+        rows += len(fn(*args))
+    elapsed = time.perf_counter() - start
+    print(f"{label:28s} {elapsed / len(args_list) * 1e3:9.3f} ms/query  ({rows / len(args_list):.1f} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entities", type=int, default=100_000)
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--no-index", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite")
+        start = time.perf_counter()
+        ids, names = build(db_path, args.entities, args.edges)
+        print(f"built {args.entities} entities / {args.edges} calls in {time.perf_counter() - start:.1f}s")
+        if args.no_index:
+            drop_indexes(db_path)
+
+        rng = random.Random(1)
+        sample_ids = [(rng.choice(ids), ) for _ in range(SAMPLES)]
+        sample_names = [(rng.choice(names), ) for _ in range(SAMPLES)]
+        # транзитивные запросы заметно дороже: берём меньше образцов
+        deep_ids = [(ent_id, args.depth, db_path) for (ent_id, ) in sample_ids[:SAMPLES // 10]]
+        deep_names = [(name, args.depth, db_path) for (name, ) in sample_names[:SAMPLES // 10]]
+
+        bench("callers", lambda n: queries.callers(n, db_path), sample_names)
+        bench("callees", lambda i: queries.callees(i, db_path), sample_ids)
+        bench("subclasses", lambda n: queries.subclasses(n, db_path), sample_names)
+        bench("methods_of", lambda i: queries.methods_of(i, db_path), sample_ids)
+        bench(f"transitive_callees d={args.depth}", queries.transitive_callees, deep_ids)
+        bench(f"transitive_callers d={args.depth}", queries.transitive_callers, deep_ids)
+        bench(f"transitive_subclasses d={args.depth}", queries.transitive_subclasses, deep_names)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Общая часть дисковых кешей (ParseCache, ResponseCache): записи по ключу-хешу,
+сжатые zlib, с вытеснением давно не использованных.
+"""
+import os
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DiskCache:
+    """
+    Записи лежат в cache_dir/ключ[:2]/ключ. Запись идёт через временный файл
+    и os.replace, битая запись читается как промах. При попадании запись
+    «трогается» (mtime), а evict() удаляет записи старше max_age (если он задан)
+    и затем самые давно использованные, пока суммарный размер больше max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_age: Optional[float] = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _load(self, key: str, decode: Callable[[bytes], T]) -> Optional[T]:
+        """
+        decode(распакованные байты) записи или None, если записи нет или она битая.
+        """
+        try:
+            return decode(zlib.decompress(self._path(key).read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (ValueError, EOFError, TypeError, zlib.error):
+            # битая запись — считаем промахом, перезапишется
+            return None
+
+    def _touch(self, key: str):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _discard(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _store(self, key: str, data: bytes):
+        payload = zlib.compress(data, 1)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # запись через временный файл: параллельные читатели не видят половину
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def evict(self):
+        """
+        Удаляет записи старше max_age, затем самые давно использованные,
+        пока кеш больше max_bytes.
+        """
+        if not self.cache_dir.is_dir():
+            return
+
+        # возраст по mtime — верхняя оценка: mtime обновляется при попаданиях
+        deadline = time.time() - self.max_age if self.max_age is not None else None
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("??/*"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if deadline is not None and st.st_mtime < deadline:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,16 +1,50 @@
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterator, List, Optional
 
-from parsers import parse_python
-from storage import save_entities
+from parsers.cache import ParseCache
+from parsers.entity import ParsedEntity
+from parsers.parse_python import iter_python_entities
+from storage import BulkWriter, save_entities
 
 PARSER_MAP = {
-    ".py": parse_python,
+    ".py": iter_python_entities,
 }
 
-def dispatch_file(path: Path):
+def iter_file_entities(
+    path: Path,
+    cache: Optional[ParseCache] = None,
+) -> Optional[Iterator[ParsedEntity]]:
+    """
+    Поток сущностей файла от подходящего парсера (через кеш, если он задан).
+    Возвращает None, если для расширения нет парсера.
+    """
     parser = PARSER_MAP.get(path.suffix.lower())
     if parser is None:
+        return None
+
+    if cache is not None:
+        return cache.cached(parser, path.resolve())
+    return parser(path.resolve())
+
+
+def parse_file(path: Path, cache: Optional[ParseCache] = None) -> Optional[List[ParsedEntity]]:
+    """
+    Разбирает файл целиком, ничего не сохраняя (для передачи между процессами).
+    """
+    entities = iter_file_entities(path, cache)
+    if entities is None:
+        return None
+
+    return list(entities)
+
+
+def dispatch_file(path: Path, writer: Optional[BulkWriter] = None):
+    entities = iter_file_entities(path)
+    if entities is None:
         return
-    
-    save_entities(parser(path.resolve()))
\ No newline at end of file
+
+    if writer is None:
+        save_entities(entities)
+    else:
+        writer.add(entities)
+
@@ -1,20 +1,230 @@
 import pygit2
 import logging
 import json
-from typing import List, Dict
-from collections import Counter, defaultdict
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import ContextManager, List, Dict, Iterator, Optional, Tuple
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import line_history
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_repo(path: str) -> pygit2.Repository:
-    return pygit2.Repository(path)
+REPO_IDLE_TTL = float(os.getenv("REPO_IDLE_TTL", "300"))
+
+
+def _head_target(repo: pygit2.Repository) -> Optional[str]:
+    try:
+        return str(repo.head.target)
+    except pygit2.GitError:
+        # пустой репозиторий или битый HEAD
+        return None
+
+
+class RepositoryPool:
+    """
+    Пул открытых pygit2.Repository по пути.
+
+    Объекты pygit2 не потокобезопасны, поэтому у каждого потока свои дескрипторы.
+    Дескриптор берётся через checkout() и живёт между запросами (кеш объектов
+    и индексы packfile остаются тёплыми), переоткрывается, если HEAD сдвинулся
+    с момента открытия. Простаивающие дольше idle_ttl дескрипторы закрывает
+    общий фоновый обход sweep() — в том числе дескрипторы простаивающих потоков;
+    выданные в checkout() и ещё не возвращённые он не трогает.
+    """
+
+    def __init__(self, idle_ttl: float = REPO_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        # (поток, путь) -> [repo, HEAD при открытии, время возврата, число выдач]
+        self._handles: Dict[Tuple[int, str], list] = {}
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+
+    @contextmanager
+    def checkout(self, path: str) -> Iterator[pygit2.Repository]:
+        key = (threading.get_ident(), os.path.abspath(path))
+        # под общим замком — только словарь и счётчики; открытие репозитория
+        # и чтение HEAD с диска идут без него
+        with self._lock:
+            self._start_sweeper()
+            entry = self._handles.get(key)
+            if entry is not None:
+                # выданный дескриптор sweep() не закроет
+                entry[3] += 1
+                sole = entry[3] == 1
+
+        # HEAD сдвинулся — переоткрываем, если дескриптор не занят выше по стеку
+        if entry is not None and sole and _head_target(entry[0]) != entry[1]:
+            with self._lock:
+                if self._handles.get(key) is entry:
+                    del self._handles[key]
+            entry[0].free()
+            entry = None
+
+        if entry is None:
+            repo = pygit2.Repository(key[1])
+            fresh = [repo, _head_target(repo), time.monotonic(), 1]
+            with self._lock:
+                entry = self._handles.setdefault(key, fresh)
+                if entry is not fresh:
+                    entry[3] += 1
+            if entry is not fresh:
+                repo.free()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[2] = time.monotonic()
+                entry[3] -= 1
+
+    def sweep(self) -> int:
+        """
+        Закрывает дескрипторы, которые не выданы и простаивают дольше idle_ttl.
+        Возвращает число закрытых.
+        """
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            stale = [key for key, (_, _, last_used, users) in self._handles.items() if users == 0 and last_used < deadline]
+            for key in stale:
+                self._handles.pop(key)[0].free()
+        return len(stale)
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(max(self.idle_ttl / 2, 1.0))
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name="repo-pool-sweeper", daemon=True)
+        self._sweeper.start()
+
+
+repo_pool = RepositoryPool()
+
+def checkout_repo(path: str) -> ContextManager[pygit2.Repository]:
+    """
+    Дескриптор репозитория из пула на время блока with.
+    """
+    return repo_pool.checkout(path)
 
 def is_service_commit(commit: pygit2.Commit) -> bool:
     service_keywords = ['merge', 'fixup', 'squash']
     message = commit.message.lower()
     return any(keyword in message for keyword in service_keywords)
 
+def get_changed_paths(
+    repo: pygit2.Repository,
+    old_commit: str,
+    new_commit: str
+) -> Tuple[List[str], List[str]]:
+    """
+    Сравнивает деревья двух коммитов и возвращает (изменённые, удалённые) пути.
+    Переименование раскладывается на удаление старого пути и изменение нового.
+    """
+    old = repo[old_commit].peel(pygit2.Commit)
+    new = repo[new_commit].peel(pygit2.Commit)
+    diff = old.tree.diff_to_tree(new.tree)
+    diff.find_similar()
+
+    changed, deleted = [], []
+    for delta in diff.deltas:
+        if delta.status == pygit2.GIT_DELTA_DELETED:
+            deleted.append(delta.old_file.path)
+        elif delta.status == pygit2.GIT_DELTA_RENAMED:
+            deleted.append(delta.old_file.path)
+            changed.append(delta.new_file.path)
+        else:
+            changed.append(delta.new_file.path)
+
+    logger.info(f"{len(changed)} changed, {len(deleted)} deleted paths between {old_commit[:7]} and {new_commit[:7]}")
+    return changed, deleted
+
+class BlameCache:
+    """
+    Кеш результатов blame: (репозиторий, HEAD-коммит, путь, диапазон) -> SHA.
+    Blame зависит от истории, которая привела к файлу, а не только от его
+    содержимого (откат к прежнему blob, другая ветка с тем же blob), поэтому
+    ключ — коммит, от которого считался blame. Для заданного коммита результат
+    не меняется: в памяти держится LRU на maxsize записей, а при заданном
+    persist_path записи ещё и сохраняются в SQLite и переживают перезапуск.
+    """
+
+    def __init__(self, maxsize: int = 4096, persist_path: Optional[str] = None):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS blame (key TEXT PRIMARY KEY, commits TEXT NOT NULL)")
+            self._db.commit()
+
+    def get(self, key: Tuple) -> Optional[List[str]]:
+        with self._lock:
+            commits = self._entries.get(key)
+            if commits is not None:
+                self._entries.move_to_end(key)
+                return list(commits)
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT commits FROM blame WHERE key = ?", (json.dumps(key),)).fetchone()
+            if row is None:
+                return None
+            commits = json.loads(row[0])
+            self._remember(key, commits)
+            return list(commits)
+
+    def put(self, key: Tuple, commits: List[str]):
+        with self._lock:
+            self._remember(key, list(commits))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO blame (key, commits) VALUES (?, ?)",
+                    (json.dumps(key), json.dumps(commits)),
+                )
+                self._db.commit()
+
+    def clear(self):
+        """
+        Очищает LRU в памяти (SQLite-часть не трогается).
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: Tuple, commits: List[str]):
+        self._entries[key] = commits
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+blame_cache = BlameCache(persist_path=os.getenv("BLAME_CACHE_PATH"))
+
+def _lookup_line_history(
+    repo: pygit2.Repository,
+    head: pygit2.Oid,
+    file_path: str,
+    ranges: List[Tuple[int, int]]
+) -> Optional[List[List[str]]]:
+    """
+    Коммиты диапазонов из индекса истории строк, если он построен и доведён до head.
+    Отставший индекс дообновляется в фоне, пока отвечает живой blame.
+    """
+    index = line_history.get_index(repo)
+    if index is None:
+        return None
+    index.update_in_background(repo.path, str(head))
+    return index.lookup_ranges(file_path, str(head), ranges)
+
 def get_commit_ids_for_lines(
     repo: pygit2.Repository,
     file_path: str,
@@ -23,8 +233,24 @@ def get_commit_ids_for_lines(
 ) -> List[str]:
     """
     Возвращает уникальные SHA-коммиты, затронувшие строки [start..end].
-    Фильтрует «сервисные» коммиты.
+    Фильтрует «сервисные» коммиты. Результат кешируется по HEAD-коммиту.
+    Если для репозитория построен индекс истории строк (line_history), blame не выполняется.
     """
+    head = repo.revparse_single("HEAD").peel(pygit2.Commit)
+    if file_path not in head.tree:
+        logger.warning(f"File {file_path} is not committed yet")
+        return []
+    key = (repo.path, str(head.id), file_path, start, end)
+    cached = blame_cache.get(key)
+    if cached is not None:
+        return cached
+
+    indexed = _lookup_line_history(repo, head.id, file_path, [(start, end)])
+    if indexed is not None:
+        unique = [sha for sha in indexed[0] if not is_service_commit(repo[sha])]
+        blame_cache.put(key, unique)
+        return unique
+
     try:
         blame = repo.blame(
             file_path,
@@ -46,60 +272,203 @@ def get_commit_ids_for_lines(
 
     unique = list(set(commits))
     logger.info(f"Found {len(unique)} unique commits for lines {start}-{end} in {file_path}")
+    blame_cache.put(key, unique)
     return unique
 
-def fetch_commit(
+def get_commit_ids_for_ranges(
+    repo: pygit2.Repository,
+    file_path: str,
+    ranges: List[Tuple[int, int]]
+) -> List[List[str]]:
+    """
+    То же, что get_commit_ids_for_lines, для многих диапазонов одного файла.
+    Файл блеймится целиком один раз, ханки раскладываются по диапазонам через bisect.
+    Результаты кладутся в blame_cache под теми же ключами, что и у одиночных запросов.
+    """
+    head = repo.revparse_single("HEAD").peel(pygit2.Commit)
+    if file_path not in head.tree:
+        logger.warning(f"File {file_path} is not committed yet")
+        return [[] for _ in ranges]
+
+    results: List[Optional[List[str]]] = [
+        blame_cache.get((repo.path, str(head.id), file_path, start, end)) for start, end in ranges
+    ]
+    if all(commits is not None for commits in results):
+        return results
+
+    indexed = _lookup_line_history(repo, head.id, file_path, ranges)
+    if indexed is not None:
+        for i, shas in enumerate(indexed):
+            if results[i] is None:
+                results[i] = [sha for sha in shas if not is_service_commit(repo[sha])]
+                blame_cache.put((repo.path, str(head.id), file_path, *ranges[i]), results[i])
+        return results
+
+    try:
+        blame = repo.blame(
+            file_path,
+            flags=(
+                pygit2.GIT_BLAME_TRACK_COPIES_SAME_FILE
+                | pygit2.GIT_BLAME_TRACK_COPIES_SAME_COMMIT_MOVES
+            )
+        )
+    except (KeyError, pygit2.GitError) as e:
+        # одна ошибка blame не должна ронять весь пакет: нерешённые диапазоны — пустые
+        logger.warning(f"Cannot blame {file_path}: {e}")
+        return [commits if commits is not None else [] for commits in results]
+    # ханки blame покрывают файл подряд и идут по возрастанию строк
+    hunk_starts = []
+    hunk_shas = []
+    service: Dict[str, bool] = {}
+    for hunk in blame:
+        sha = str(hunk.orig_commit_id)
+        if sha not in service:
+            service[sha] = is_service_commit(repo[hunk.orig_commit_id])
+        hunk_starts.append(hunk.final_start_line_number)
+        hunk_shas.append(sha)
+
+    for i, (start, end) in enumerate(ranges):
+        if results[i] is not None:
+            continue
+        lo = max(bisect_right(hunk_starts, start) - 1, 0)
+        hi = bisect_right(hunk_starts, end)
+        unique = list({sha: None for sha in hunk_shas[lo:hi] if not service[sha]})
+        blame_cache.put((repo.path, str(head.id), file_path, start, end), unique)
+        results[i] = unique
+
+    logger.info(f"Blamed {file_path} once for {len(ranges)} ranges")
+    return results
+
+def commit_paths(commit: pygit2.Commit) -> List[str]:
+    """
+    Пути, изменённые коммитом относительно первого родителя.
+    Берутся из deltas, без генерации текста патчей.
+    """
+    if commit.parents:
+        diff = commit.parents[0].tree.diff_to_tree(commit.tree)
+    else:
+        diff = commit.tree.diff_to_tree(swap=True)
+    return [delta.new_file.path or delta.old_file.path for delta in diff.deltas]
+
+
+COMMIT_CACHE_SIZE = 8192
+
+
+class CommitMetaCache:
+    """
+    LRU метаданных коммитов по (репозиторий, SHA, ...). Коммиты неизменяемы,
+    поэтому записи не устаревают и вытесняются только по размеру.
+    """
+
+    def __init__(self, maxsize: int = COMMIT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+commit_cache = CommitMetaCache()
+
+
+def _commit_summary(repo: pygit2.Repository, commit_hash: str) -> Dict:
+    key = (repo.path, commit_hash)
+    meta = commit_cache.get(key)
+    if meta is None:
+        commit = repo.get(commit_hash)
+        tz = timezone(timedelta(minutes=commit.commit_time_offset))
+        meta = {
+            "sha": str(commit.id),
+            "date": datetime.fromtimestamp(commit.commit_time, tz).isoformat(),
+            "message": commit.message.strip().splitlines()[0],
+            "files": commit_paths(commit),
+        }
+        commit_cache.put(key, meta)
+    return meta
+
+
+def _commit_hunks(
     repo: pygit2.Repository,
     commit_hash: str,
-    context_lines: int = 3,
-    max_hunks: int = 5
-) -> Dict:
-    commit = repo.get(commit_hash)
-    message = commit.message.strip().splitlines()[0]
+    target_file: str,
+    context_lines: int,
+    max_hunks: int
+) -> List[str]:
+    key = (repo.path, commit_hash, target_file, context_lines, max_hunks)
+    hunks = commit_cache.get(key)
+    if hunks is not None:
+        return hunks
 
-    files = []
-    hunks = []
+    commit = repo.get(commit_hash)
     if commit.parents:
-        parent = commit.parents[0]
-        diff = parent.tree.diff_to_tree(
-            commit.tree,
-            context_lines=context_lines,
-            interhunk_lines=1
-        )
-        for i, patch in enumerate(diff):
-            if i >= max_hunks:
-                break
-
-            # путь файла
-            path = patch.delta.new_file.path or patch.delta.old_file.path
-            files.append(path)
-
-            # вытаскиваем первые строки из patch.text
-            text = patch.text or ""
-            snippet = "\n".join(text.splitlines()[:context_lines*2 + 5])
-            hunks.append(snippet)
+        diff = commit.parents[0].tree.diff_to_tree(commit.tree, context_lines=context_lines, interhunk_lines=1)
     else:
-        # initial commit
-        for entry in commit.tree:
-            files.append(entry.name)
+        diff = commit.tree.diff_to_tree(context_lines=context_lines, interhunk_lines=1, swap=True)
 
-    return {
-        "message": message,
-        "files": files,
-        "diff_hunks": hunks
-    }
+    hunks = []
+    # патч строится только для целевого файла: diff[i] генерирует текст одного delta
+    for i, delta in enumerate(diff.deltas):
+        if target_file in (delta.new_file.path, delta.old_file.path):
+            for hunk in diff[i].hunks[:max_hunks]:
+                lines = [hunk.header.rstrip("\n")]
+                lines.extend(f"{line.origin}{line.content.rstrip(chr(10))}" for line in hunk.lines)
+                hunks.append("\n".join(lines))
+            break
+
+    commit_cache.put(key, hunks)
+    return hunks
+
+
+def fetch_commit(
+    repo: pygit2.Repository,
+    commit_hash: str,
+    context_lines: int = 3,
+    max_hunks: int = 5,
+    *,
+    target_file: Optional[str] = None
+) -> Dict:
+    """
+    Метаданные коммита: sha, date, message, files (все изменённые пути).
+    diff_hunks заполняется, только если задан target_file, и только ханками этого файла.
+    Списки копируются: закешированные значения общие для всех вызывающих.
+    """
+    meta = dict(_commit_summary(repo, commit_hash))
+    meta["files"] = list(meta["files"])
+    meta["diff_hunks"] = (
+        list(_commit_hunks(repo, commit_hash, target_file, context_lines, max_hunks))
+        if target_file is not None else []
+    )
+    return meta
 
 
 def get_information_for_commits(
     repo: pygit2.Repository,
-    commits: List[str]
+    commits: List[str],
+    target_file: Optional[str] = None
 ) -> List[Dict]:
     """
     Для списка SHA возвращает список объектов с метаданными.
+    Ханки диффа строятся только при заданном target_file.
     """
     info = []
     for sha in commits:
-        meta = fetch_commit(repo, sha)
+        meta = fetch_commit(repo, sha, target_file=target_file)
         info.append(meta)
     return info
 
@@ -198,16 +567,16 @@ def build_llm_prompt(
 
 
 def main():
-    repo = get_repo("clean-architecture")
-    # 1) собираем SHA
-    shas = get_commit_ids_for_lines(repo, "auctioning_platform/payments/payments/dao.py", 48, 52)
-    # 2) получаем метаданные
-    commits_meta = get_information_for_commits(repo, shas)
-    # 3) считаем coupling
-    coupling = compute_coupling(commits_meta, "auctioning_platform/payments/payments/dao.py")
-
-    target = {"file": "auctioning_platform/payments/payments/dao.py", "start": 48, "end": 52}
-    print(build_llm_prompt(target, commits_meta, coupling))
+    with checkout_repo("clean-architecture") as repo:
+        # 1) собираем SHA
+        shas = get_commit_ids_for_lines(repo, "auctioning_platform/payments/payments/dao.py", 48, 52)
+        # 2) получаем метаданные
+        commits_meta = get_information_for_commits(repo, shas)
+        # 3) считаем coupling
+        coupling = compute_coupling(commits_meta, "auctioning_platform/payments/payments/dao.py")
+
+        target = {"file": "auctioning_platform/payments/payments/dao.py", "start": 48, "end": 52}
+        print(build_llm_prompt(target, commits_meta, coupling))
 
 if __name__ == "__main__":
     main()
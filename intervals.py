@@ -0,0 +1,94 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from storage import init_db, load_file_intervals
+
+Interval = Tuple[int, int, str]  # start_line, end_line, entity id
+
+
+class IntervalIndex:
+    """
+    Индекс диапазонов строк сущностей одного файла: «какая сущность объемлет строку L».
+
+    Диапазоны классов и функций либо вложены, либо не пересекаются. Поэтому
+    достаточно отсортировать их по началу и запомнить ближайшего родителя:
+    bisect находит последний диапазон, начавшийся не позже L, а дальше
+    поднимаемся по родителям до первого, который ещё не закончился.
+    """
+
+    def __init__(self, intervals: Iterable[Interval]):
+        # при равном начале внешний (более длинный) диапазон идёт первым
+        items = sorted(intervals, key=lambda it: (it[0], -it[1]))
+        self.starts: List[int] = [start for start, _, _ in items]
+        self.ends: List[int] = [end for _, end, _ in items]
+        self.ids: List[str] = [ent_id for _, _, ent_id in items]
+        self.parents: List[int] = []
+
+        stack: List[int] = []
+        for i, (start, _, _) in enumerate(items):
+            while stack and self.ends[stack[-1]] < start:
+                stack.pop()
+            self.parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def enclosing(self, line: int) -> Optional[Interval]:
+        """
+        Самая внутренняя сущность, диапазон которой содержит line.
+        """
+        i = bisect_right(self.starts, line) - 1
+        while i >= 0 and self.ends[i] < line:
+            i = self.parents[i]
+        if i < 0:
+            return None
+        return self.starts[i], self.ends[i], self.ids[i]
+
+
+class IntervalIndexCache:
+    """
+    Держит в памяти индексы последних maxsize файлов.
+    Сбрасывается целиком, когда БД меняет другое соединение (PRAGMA data_version).
+    """
+
+    def __init__(self, db_path: str = 'db.sqlite', maxsize: int = 256):
+        self.db_path = db_path
+        self.maxsize = maxsize
+        self._indexes: "OrderedDict[str, IntervalIndex]" = OrderedDict()
+        self._conn = None
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        if self._conn is None:
+            self._conn = init_db(self.db_path).connect()
+        version = self._conn.execute(text("PRAGMA data_version")).scalar()
+        if version != self._data_version:
+            self._indexes.clear()
+            self._data_version = version
+
+    def get(self, file_uri: str) -> IntervalIndex:
+        with self._lock:
+            self._check_version()
+            index = self._indexes.get(file_uri)
+            if index is not None:
+                self._indexes.move_to_end(file_uri)
+                return index
+
+            index = IntervalIndex(load_file_intervals(file_uri, self.db_path))
+            self._indexes[file_uri] = index
+            if len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+            return index
+
+    def enclosing(self, file_path: str, line: int) -> Optional[Interval]:
+        """
+        Сущность, объемлющая строку line файла file_path (путь на диске).
+        """
+        return self.get(Path(file_path).resolve().as_uri()).enclosing(line)
@@ -0,0 +1,318 @@
+"""
+Индекс истории строк: для каждого файла в HEAD — какой коммит породил каждую строку.
+
+Строится заранее полным blame каждого файла и хранится в SQLite в .git
+репозитория. Строки файла хранятся run-length: массив начал отрезков
+и массив номеров коммитов (оба array('I') в BLOB), поэтому запрос
+диапазона — это bisect по началам и срез.
+
+    python -m line_history <repo> [--rebuild]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_right
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import pygit2
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "beeline_line_history.sqlite"
+SCHEMA_VERSION = 2
+
+# SQLite ограничивает число параметров запроса (в старых сборках — 999)
+MAX_VARIABLES = 900
+
+BLAME_FLAGS = (
+    pygit2.GIT_BLAME_TRACK_COPIES_SAME_FILE
+    | pygit2.GIT_BLAME_TRACK_COPIES_SAME_COMMIT_MOVES
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    idx INTEGER PRIMARY KEY,
+    sha TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    starts BLOB NOT NULL,
+    commits BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+Runs = Tuple[array, List[str]]  # начала отрезков (1-based), SHA каждого отрезка
+
+
+def _chunks(items: Sequence, size: int = MAX_VARIABLES) -> Iterator[Sequence]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def blame_runs(repo: pygit2.Repository, path: str, head: pygit2.Oid) -> Runs:
+    """
+    Полный blame файла в коммите head, свёрнутый в отрезки подряд идущих строк одного коммита.
+    """
+    starts = array("I")
+    shas: List[str] = []
+    for hunk in repo.blame(path, flags=BLAME_FLAGS, newest_commit=head):
+        sha = str(hunk.orig_commit_id)
+        if shas and shas[-1] == sha:
+            continue
+        starts.append(hunk.final_start_line_number)
+        shas.append(sha)
+    return starts, shas
+
+
+def _indexable_paths(tree: pygit2.Tree, prefix: str = "") -> Iterable[str]:
+    for entry in tree:
+        path = f"{prefix}{entry.name}"
+        if entry.type_str == "tree":
+            yield from _indexable_paths(entry, f"{path}/")
+        elif entry.type_str == "blob" and not entry.peel(pygit2.Blob).is_binary:
+            yield path
+
+
+def _is_indexable(tree: pygit2.Tree, path: str) -> bool:
+    if path not in tree:
+        return False
+    entry = tree[path]
+    return entry.type_str == "blob" and not entry.peel(pygit2.Blob).is_binary
+
+
+def _touched_paths(repo: pygit2.Repository, since: str, head: pygit2.Oid) -> Set[str]:
+    """
+    Пути, изменённые хоть одним коммитом от since (не включая) до head.
+    Берутся все коммиты диапазона, а не дифф крайних деревьев: у файла,
+    изменённого и затем откатанного, то же содержимое, но другой blame.
+    ValueError, если since не предок head.
+    """
+    since_oid = pygit2.Oid(hex=since)
+    if not repo.descendant_of(head, since_oid):
+        raise ValueError(f"{since} is not an ancestor of {head}")
+    walker = repo.walk(head)
+    walker.hide(since_oid)
+
+    paths: Set[str] = set()
+    for commit in walker:
+        if commit.parents:
+            diff = commit.parents[0].tree.diff_to_tree(commit.tree)
+        else:
+            diff = commit.tree.diff_to_tree(swap=True)
+        for delta in diff.deltas:
+            paths.add(delta.old_file.path)
+            paths.add(delta.new_file.path)
+    return paths
+
+
+class LineHistoryIndex:
+    """
+    Индекс строк -> коммитов по файлам одного проиндексированного коммита.
+
+    build() блеймит все текстовые файлы; update() после новых коммитов
+    переблеймит только файлы, которые трогал хоть один новый коммит.
+    lookup() отвечает, только если индекс построен ровно для запрошенного
+    коммита, иначе возвращает None, и вызывающий делает живой blame.
+    У каждого потока своё соединение с базой.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._update_lock = threading.Lock()
+        self._local = threading.local()
+        # WAL хранится в самом файле базы, поэтому включается один раз при создании
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS commits; DROP TABLE IF EXISTS state;")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+        return conn
+
+    @property
+    def indexed_head(self) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM state WHERE key = 'head'").fetchone()
+        return row[0] if row else None
+
+    def _commit_ids(self, conn: sqlite3.Connection, shas: List[str]) -> List[int]:
+        unique = list(set(shas))
+        conn.executemany("INSERT OR IGNORE INTO commits (sha) VALUES (?)", ((sha,) for sha in unique))
+        ids: Dict[str, int] = {}
+        for chunk in _chunks(unique):
+            ids.update(conn.execute(
+                f"SELECT sha, idx FROM commits WHERE sha IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return [ids[sha] for sha in shas]
+
+    def _store(self, conn: sqlite3.Connection, path: str, runs: Runs):
+        starts, shas = runs
+        commits = array("I", self._commit_ids(conn, shas)) if shas else array("I")
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, starts, commits) VALUES (?, ?, ?)",
+            (path, starts.tobytes(), commits.tobytes()),
+        )
+
+    def _index_files(self, conn: sqlite3.Connection, repo: pygit2.Repository, head: pygit2.Oid, paths: Iterable[str]) -> int:
+        count = 0
+        for path in paths:
+            try:
+                runs = blame_runs(repo, path, head)
+            except (KeyError, pygit2.GitError) as e:
+                logger.warning(f"Cannot blame {path}: {e}")
+                continue
+            self._store(conn, path, runs)
+            count += 1
+        return count
+
+    def _build(self, conn: sqlite3.Connection, repo: pygit2.Repository, head: pygit2.Oid) -> int:
+        with conn:
+            # commits не чистим: номера коммитов не переиспользуются,
+            # и параллельный lookup не сопоставит старый номер чужому SHA
+            conn.execute("DELETE FROM files")
+            count = self._index_files(conn, repo, head, _indexable_paths(repo[head].peel(pygit2.Commit).tree))
+            conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('head', ?)", (str(head),))
+        logger.info(f"Line history: indexed {count} files at {str(head)[:7]}")
+        return count
+
+    def build(self, repo: pygit2.Repository) -> int:
+        """
+        Индексирует все текстовые файлы HEAD с нуля. Возвращает число файлов.
+        """
+        with self._update_lock:
+            return self._build(self._conn(), repo, repo.head.target)
+
+    def update(self, repo: pygit2.Repository) -> int:
+        """
+        Доводит индекс до текущего HEAD: переблеймит файлы, которые трогали
+        коммиты после прошлого обхода, и удаляет исчезнувшие.
+        Без сохранённого HEAD или если он больше не предок HEAD
+        (история переписана) — полная перестройка.
+        """
+        with self._update_lock:
+            conn = self._conn()
+            head = repo.head.target
+            last = self.indexed_head
+            if last == str(head):
+                return 0
+            if last is None:
+                return self._build(conn, repo, head)
+
+            try:
+                touched = _touched_paths(repo, last, head)
+            except (KeyError, ValueError, pygit2.GitError):
+                logger.warning(f"Indexed head {last} is not in HEAD history, rebuilding line history")
+                return self._build(conn, repo, head)
+
+            tree = repo[head].peel(pygit2.Commit).tree
+            with conn:
+                for chunk in _chunks(sorted(touched)):
+                    conn.execute(f"DELETE FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                count = self._index_files(conn, repo, head, (p for p in sorted(touched) if _is_indexable(tree, p)))
+                conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('head', ?)", (str(head),))
+            logger.info(f"Line history: re-indexed {count} files up to {str(head)[:7]}")
+            return count
+
+    def update_in_background(self, repo_path: str, head: Optional[str] = None) -> Optional[threading.Thread]:
+        """
+        Запускает update() в отдельном потоке со своим Repository,
+        если обновление ещё не идёт и индекс отстаёт от head (если он задан).
+        """
+        if self._update_lock.locked() or (head is not None and head == self.indexed_head):
+            return None
+
+        def run():
+            try:
+                self.update(pygit2.Repository(repo_path))
+            except Exception:
+                logger.exception(f"Line history update failed for {repo_path}")
+
+        thread = threading.Thread(target=run, name="line-history", daemon=True)
+        thread.start()
+        return thread
+
+    def lookup_ranges(self, path: str, head: str, ranges: List[Tuple[int, int]]) -> Optional[List[List[str]]]:
+        """
+        SHA коммитов, породивших строки каждого диапазона [start..end], без повторов.
+        None, если индекс построен не для коммита head или файла в нём нет.
+        """
+        conn = self._conn()
+        # файл и состояние читаются одним запросом, чтобы не попасть между ними на update()
+        row = conn.execute(
+            "SELECT f.starts, f.commits FROM files f JOIN state s ON s.key = 'head' AND s.value = ? "
+            "WHERE f.path = ?",
+            (head, path),
+        ).fetchone()
+        if row is None:
+            return None
+        starts, commits = array("I"), array("I")
+        starts.frombytes(row[0])
+        commits.frombytes(row[1])
+
+        per_range = []
+        for start, end in ranges:
+            lo = max(bisect_right(starts, start) - 1, 0)
+            hi = bisect_right(starts, end)
+            per_range.append(list(dict.fromkeys(commits[lo:hi])))
+
+        needed = list({idx for ids in per_range for idx in ids})
+        shas: Dict[int, str] = {}
+        for chunk in _chunks(needed):
+            shas.update(conn.execute(
+                f"SELECT idx, sha FROM commits WHERE idx IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return [[shas[idx] for idx in ids] for ids in per_range]
+
+    def lookup(self, path: str, head: str, start: int, end: int) -> Optional[List[str]]:
+        found = self.lookup_ranges(path, head, [(start, end)])
+        return found[0] if found is not None else None
+
+
+_indexes: Dict[str, LineHistoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(repo: pygit2.Repository, create: bool = False) -> Optional[LineHistoryIndex]:
+    """
+    Индекс репозитория (.git/beeline_line_history.sqlite).
+    Если индекс ещё не строили и create=False — None.
+    """
+    db_path = os.path.join(repo.path, DB_NAME)
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            if not create and not os.path.exists(db_path):
+                return None
+            index = _indexes[db_path] = LineHistoryIndex(db_path)
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the line history index of a repository")
+    parser.add_argument("repo", help="Path to the git repository")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index from scratch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    repo = pygit2.Repository(args.repo)
+    index = get_index(repo, create=True)
+    if args.rebuild:
+        index.build(repo)
+    else:
+        index.update(repo)
+
+
+if __name__ == "__main__":
+    main()
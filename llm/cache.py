@@ -0,0 +1,66 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from disk_cache import DiskCache
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+class ResponseCache(DiskCache):
+    """
+    Кеш ответов LLM на диске, адресуемый содержимым запроса.
+
+    Ключ — blake2b от modelUri, сообщений (system + user) и completionOptions
+    без stream: потоковый и обычный запрос дают один и тот же текст. Значение —
+    zlib(json) с текстом, временем создания, задержкой и числом токенов исходного
+    ответа; по ним в stats копится сэкономленное время и токены.
+    Записи старше max_age считаются промахом. Хранение и вытеснение — DiskCache.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE):
+        super().__init__(cache_dir, max_bytes, max_age)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, float] = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "saved_tokens": 0}
+
+    def key(self, payload: dict) -> str:
+        options = {k: v for k, v in payload.get("completionOptions", {}).items() if k != "stream"}
+        material = json.dumps(
+            [payload.get("modelUri"), payload.get("messages"), options],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.blake2b(material.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self.stats[name] += value
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._load(key, json.loads)
+        if entry is None:
+            self._count(misses=1)
+            return None
+        if time.time() - entry["created"] > self.max_age:
+            self._discard(key)
+            self._count(misses=1)
+            return None
+
+        self._touch(key)
+        self._count(hits=1, saved_seconds=entry.get("latency", 0.0), saved_tokens=entry.get("tokens", 0))
+        return entry["text"]
+
+    def put(self, key: str, text: str, latency: float = 0.0, tokens: int = 0):
+        entry = {"created": time.time(), "text": text, "latency": latency, "tokens": tokens}
+        self._store(key, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -1,17 +1,38 @@
 from __future__ import annotations
+import asyncio
 import zipfile
 from yandex_cloud_ml_sdk import YCloudML
 import os
 from pathlib import Path
-import requests, json
-from pathlib import Path
+from typing import AsyncIterator
+import json
+import httpx
 import shutil
+import hashlib
+import time
+
+from llm.cache import ResponseCache
+from llm.packing import estimate_tokens, first_fit_decreasing, truncate_to_tokens
 
 
 API_KEY = os.getenv("api_key")
 FOLDER_ID = os.getenv("folder")
 URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
 
+# сколько запросов к LLM одновременно отправляет один процесс
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# квота провайдера: запросов в секунду и допустимый всплеск
+LLM_RPS = float(os.getenv("LLM_RPS", "10"))
+LLM_BURST = int(os.getenv("LLM_BURST", str(max(1, int(LLM_RPS)))))
+
+# кеш ответов: одинаковый запрос (модель, промпты, опции) не отправляется повторно
+response_cache = ResponseCache(
+    os.getenv("LLM_CACHE_DIR", ".beeline_cache/llm"),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 2**20,
+    max_age=float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+)
+
 
 model_uri = f"gpt://{FOLDER_ID}/yandexgpt-32k/latest"
 MODEL_URI = f"gpt://{FOLDER_ID}/yandexgpt-32k/latest"
@@ -59,13 +80,8 @@ headers = {
 }
 
 
-def generate_doc_for_file(filepath: str) -> str:
-    code = Path(filepath).read_text(encoding="utf-8")
-    if not code.strip():
-        print(f"Skipping empty file: {filepath}")
-        return ""
-
-    payload = {
+def _file_doc_payload(code: str) -> dict:
+    return {
         "modelUri": model_uri,
         "completionOptions": {"stream": False, "temperature": 0.3, "maxTokens": 1500},
         "messages": [
@@ -74,14 +90,13 @@ def generate_doc_for_file(filepath: str) -> str:
         ],
     }
 
-    print(filepath)
 
-    r = requests.post(URL, headers=headers, json=payload, timeout=120)
-    if r.status_code != 200:
-        print(f"Status code: {r.status_code}")
-        print(f"Response content: {r.text}")
-    r.raise_for_status()
-    return r.json()["result"]["alternatives"][0]["message"]["text"]
+async def generate_doc_for_file_async(filepath: str) -> str:
+    code = Path(filepath).read_text(encoding="utf-8")
+    if not code.strip():
+        print(f"Skipping empty file: {filepath}")
+        return ""
+    return await post_completion_async(_file_doc_payload(code))
 
 def zip_docs() -> Path:
     """
@@ -99,16 +114,51 @@ def zip_docs() -> Path:
     return zip_path
 
 
-def generate_docs(zip_file: bytes) -> Path:
+# хеши входов сгенерированных документов: исходник -> doc файла,
+# docs файлов модуля -> doc модуля, docs модулей -> обзор проекта
+DOCS_MANIFEST = Path("/content/docs_manifest.json")
+
+
+def load_docs_manifest() -> dict:
+    try:
+        manifest = json.loads(DOCS_MANIFEST.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest.setdefault("modules", {})
+    manifest.setdefault("overview", None)
+    return manifest
+
+
+def save_docs_manifest(manifest: dict) -> None:
+    DOCS_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    tmp = DOCS_MANIFEST.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, DOCS_MANIFEST)
+
+
+def _digest(*parts: str | bytes) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(part.encode("utf-8") if isinstance(part, str) else part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def module_doc_path(docs_root: Path, mod_name: str) -> Path:
+    return docs_root / mod_name / f"{mod_name}_module.md"
+
+
+async def generate_docs_async(zip_file: bytes) -> Path:
     """
-    Generates documentation for the provided zip file
-    Returns path to generated zip file
+    Generates documentation for the provided zip file.
+    Files are sent concurrently (LLM_CONCURRENCY, LLM_RPS) and each doc is
+    written as soon as its response arrives.
+    Only files whose source (or prompt/model) changed since the last run are
+    regenerated; docs of files missing from the upload are removed.
     """
-    # Create paths using Path objects
-    # Setup paths
     temp_dir = Path("/content/temp_repo")
     output_dir = Path("/content/generated_docs")
-    
 
     # Create directories
     temp_dir.mkdir(parents=True, exist_ok=True)
@@ -124,96 +174,148 @@ def generate_docs(zip_file: bytes) -> Path:
 
     # Collect Python files
     py_files = collect_python_files(str(temp_dir))
-    print(f"Будем обрабатывать {len(py_files)} файлов…")
 
+    manifest = load_docs_manifest()
+    hashes = {}
+    stale = []
     for path in py_files:
+        rel = Path(path).relative_to(temp_dir)
+        # в хеш входят модель и промпт: при их смене docs пересобираются
+        hashes[rel.as_posix()] = _digest(model_uri, system_prompt, Path(path).read_bytes())
+        if manifest["files"].get(rel.as_posix()) != hashes[rel.as_posix()] or not (output_dir / rel).with_suffix(".md").exists():
+            stale.append(path)
+
+    for rel in set(manifest["files"]) - set(hashes):
+        (output_dir / rel).with_suffix(".md").unlink(missing_ok=True)
+        del manifest["files"][rel]
+    print(f"Будем обрабатывать {len(stale)} из {len(py_files)} файлов…")
+
+    async def process(path: str):
         try:
             print("Обработка:", path)
-            doc = generate_doc_for_file(path)
-            md_name = Path(path).relative_to(temp_dir).with_suffix(".md")
-            out_path = output_dir / md_name
+            doc = await generate_doc_for_file_async(path)
+            rel = Path(path).relative_to(temp_dir)
+            out_path = output_dir / rel.with_suffix(".md")
             out_path.parent.mkdir(parents=True, exist_ok=True)
             out_path.write_text(doc, encoding="utf-8")
+            manifest["files"][rel.as_posix()] = hashes[rel.as_posix()]
             print("Сохранено:", out_path)
         except Exception as e:
             print("Ошибка для", path, ":", e)
 
+    try:
+        await asyncio.gather(*(process(path) for path in stale))
+    finally:
+        # упавшие файлы не попадают в манифест и перегенерируются в следующий раз
+        save_docs_manifest(manifest)
+    return output_dir
 
-def generate_module_docs():
 
-    docs_root = Path("/content/generated_docs")
-    HEADERS = headers  # Reuse headers defined above
+# контекст yandexgpt-32k; из него вычитаются ответ, промпты и запас на неточность оценки
+MODEL_CONTEXT_TOKENS = 32000
+MERGE_MAX_TOKENS = 1200
+MERGE_PROMPT_RESERVE = 500
+MERGE_INPUT_TOKENS = int((MODEL_CONTEXT_TOKENS - MERGE_MAX_TOKENS - MERGE_PROMPT_RESERVE) * 0.9)
+
+MERGE_SYSTEM_PROMPT = "Ты — AI-документовед. Объединяй документации файлов в описание модуля."
 
-    MAX_CHARS = 10000  # ограничение размера запроса
 
-    def merge_batch(mod_name: str, files_batch: list[tuple[str, str]]) -> str:
-        joined = "\n\n".join(f"### {Path(path).name}\n{text}" for path, text in files_batch)
-        prompt = (
-            f"Документации файлов модуля `{mod_name}`. Слей их в единое описание. "
-            f"Опиши архитектуру, назначение, компоненты и use-cases. Markdown-формат.\n\n{joined}"
+def _merge_payload(mod_name: str, parts: list[tuple[str, str]], reduce: bool) -> dict:
+    joined = "\n\n".join(f"### {name}\n{text}" for name, text in parts)
+    if reduce:
+        task = (
+            f"Частичные описания модуля `{mod_name}`, каждое по своей группе файлов. "
+            f"Слей их в одно цельное описание модуля без повторов."
         )
-        payload = {
-            "modelUri": MODEL_URI,
-            "completionOptions": {"stream": False, "temperature": 0.2, "maxTokens": 1200},
-            "messages": [
-                {
-                    "role": "system",
-                    "text": "Ты — AI-документовед. Объединяй документации файлов в описание модуля.",
-                },
-                {"role": "user", "text": prompt},
-            ],
-        }
-        response = requests.post(URL, headers=HEADERS, json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json()["result"]["alternatives"][0]["message"]["text"]
-
-    def split_into_batches(md_files, max_chars=MAX_CHARS):
-        batches, batch, size = [], [], 0
-        for f in md_files:
-            length = len(f[1])
-            if size + length > max_chars and batch:
-                batches.append(batch)
-                batch, size = [], 0
-            batch.append(f)
-            size += length
-        if batch:
-            batches.append(batch)
-        return batches
-
-    # Основной цикл с батчами
-    for mod_dir in docs_root.iterdir():
-        if not mod_dir.is_dir():
-            continue
+    else:
+        task = f"Документации файлов модуля `{mod_name}`. Слей их в единое описание."
+    prompt = f"{task} Опиши архитектуру, назначение, компоненты и use-cases. Markdown-формат.\n\n{joined}"
+    return {
+        "modelUri": MODEL_URI,
+        "completionOptions": {"stream": False, "temperature": 0.2, "maxTokens": MERGE_MAX_TOKENS},
+        "messages": [
+            {"role": "system", "text": MERGE_SYSTEM_PROMPT},
+            {"role": "user", "text": prompt},
+        ],
+    }
+
+
+def _part_tokens(part: tuple[str, str]) -> int:
+    name, text = part
+    return estimate_tokens(f"### {name}\n{text}") + 2
+
+
+async def merge_module_docs(mod_name: str, parts: list[tuple[str, str]]) -> str:
+    """
+    Иерархический map-reduce: части раскладываются first-fit-decreasing
+    по запросам объёмом MERGE_INPUT_TOKENS, запросы уровня идут параллельно,
+    их ответы снова раскладываются и сливаются, пока не останется один документ.
+    """
+    # слишком большой документ файла не влезет ни в один запрос — обрезаем
+    parts = [(name, truncate_to_tokens(text, MERGE_INPUT_TOKENS - 50)) for name, text in parts]
+    reduce = False
+    level = 1
+    while True:
+        bins = first_fit_decreasing(parts, _part_tokens, MERGE_INPUT_TOKENS)
+        print(f"🔸 Модуль {mod_name}, уровень {level}: {len(parts)} частей -> {len(bins)} запросов")
+        merged = await asyncio.gather(*(
+            post_completion_async(_merge_payload(mod_name, b, reduce)) for b in bins
+        ))
+        if len(merged) == 1:
+            return merged[0]
+        parts = [(f"Часть {i}", text) for i, text in enumerate(merged, 1)]
+        reduce = True
+        level += 1
+
+
+async def generate_module_docs_async():
+    docs_root = Path("/content/generated_docs")
+
+    manifest = load_docs_manifest()
+    mod_dirs = [d for d in docs_root.iterdir() if d.is_dir()]
+    for mod_name in set(manifest["modules"]) - {d.name for d in mod_dirs}:
+        del manifest["modules"][mod_name]
+
+    async def process(mod_dir: Path):
         mod_name = mod_dir.name
+        out_path = module_doc_path(docs_root, mod_name)
         print(f"\n📦 Модуль: {mod_name}")
 
-        md_files = [(str(f), f.read_text(encoding="utf-8")) for f in mod_dir.rglob("*.md")]
+        md_files = sorted(
+            (f.relative_to(mod_dir).as_posix(), f.read_text(encoding="utf-8"))
+            for f in mod_dir.rglob("*.md") if f != out_path
+        )
         if not md_files:
             print(f"Нет документов для модуля {mod_name}")
-            continue
-
-        batches = split_into_batches(md_files)
-        print(f"Разбили на {len(batches)} батчей.")
+            out_path.unlink(missing_ok=True)
+            manifest["modules"].pop(mod_name, None)
+            return
 
-        module_docs = []
-        for i, batch in enumerate(batches, 1):
-            print(f"🔸 Отправляем батч {i}/{len(batches)} (файлов: {len(batch)})")
-            try:
-                part_doc = merge_batch(mod_name, batch)
-                module_docs.append(part_doc)
-            except requests.exceptions.HTTPError as e:
-                print(f"Ошибка на батче {i} модуля '{mod_name}': {e}")
-                continue
+        # doc модуля зависит только от docs его файлов
+        inputs_hash = _digest(*(part for rel, text in md_files for part in (rel, text)))
+        if manifest["modules"].get(mod_name) == inputs_hash and out_path.exists():
+            print(f"Модуль {mod_name} не изменился")
+            return
 
-        final_doc = "\n\n".join(module_docs)
+        # ошибка одного модуля (HTTP, битый ответ) не должна ронять остальные
+        try:
+            final_doc = await merge_module_docs(mod_name, md_files)
+        except Exception as e:
+            print(f"Ошибка модуля '{mod_name}': {e}")
+            return
 
         #  Теперь сохраняем внутри папки модуля:
-        out_path = mod_dir / f"{mod_name}_module.md"
         out_path.write_text(final_doc, encoding="utf-8")
+        manifest["modules"][mod_name] = inputs_hash
         print(f"Сохранено в папке модуля: {out_path}")
 
+    try:
+        await asyncio.gather(*(process(mod_dir) for mod_dir in mod_dirs))
+    finally:
+        save_docs_manifest(manifest)
 
-def generate_overview_docs():
+
+async def generate_overview_docs_async():
     docs_root = Path("/content/generated_docs")
     output_path = docs_root / "project_overview.md"
 
@@ -224,8 +326,18 @@ def generate_overview_docs():
     module_entries = []
     module_docs = []
 
-    for f in docs_root.rglob("*_module.md"):
-        mod_name = f.stem.replace("_module", "")
+    manifest = load_docs_manifest()
+    module_paths = sorted(module_doc_path(docs_root, d.name) for d in docs_root.iterdir() if d.is_dir())
+    module_paths = [f for f in module_paths if f.exists()]
+
+    # обзор зависит только от docs модулей
+    inputs_hash = _digest(*(part for f in module_paths for part in (f.parent.name, f.read_text(encoding="utf-8"))))
+    if manifest["overview"] == inputs_hash and output_path.exists():
+        print("Документация модулей не изменилась, обзор не пересобирается")
+        return
+
+    for f in module_paths:
+        mod_name = f.parent.name
         rel_doc_path = f.relative_to(docs_root)
 
         source_mod_path = project_root_path / rel_doc_path.parent
@@ -262,19 +374,17 @@ def generate_overview_docs():
             {"role": "user", "text": prompt}
         ]
     }
-    HEADERS = headers
-
-    response = requests.post(URL, headers=HEADERS, json=payload, timeout=120)
-    response.raise_for_status()
-    overview = response.json()["result"]["alternatives"][0]["message"]["text"]
+    overview = await post_completion_async(payload)
 
     output_path.write_text(overview, encoding="utf-8")
+    manifest["overview"] = inputs_hash
+    save_docs_manifest(manifest)
     print(f"✅ Сохранено: {output_path}")
     print("\n---\n", overview[:1000], "\n...")
 
 
-def generate_answer_for_git(prompt: str) -> str:
-    payload = {
+def _git_answer_payload(prompt: str) -> dict:
+    return {
         "modelUri": MODEL_URI,
         "completionOptions": {"stream": False, "temperature": 0.2, "maxTokens": 1200},
         "messages": [
@@ -282,7 +392,133 @@ def generate_answer_for_git(prompt: str) -> str:
             {"role": "user", "text": prompt}
         ]
     }
-    HEADERS = headers
-    response = requests.post(URL, headers=HEADERS, json=payload, timeout=120)
+
+
+def _usage_tokens(result: dict) -> int:
+    try:
+        return int(result["usage"]["totalTokens"])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: rate токенов в секунду, не больше capacity в запасе.
+    acquire() ждёт, пока не накопится токен.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_async_client: httpx.AsyncClient | None = None
+_llm_semaphore: asyncio.Semaphore | None = None
+_rate_limiter: TokenBucket | None = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Общий httpx.AsyncClient процесса: соединения к API переиспользуются между запросами.
+    """
+    global _async_client, _llm_semaphore, _rate_limiter
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            headers=headers,
+            timeout=LLM_TIMEOUT,
+            limits=httpx.Limits(max_connections=LLM_CONCURRENCY, max_keepalive_connections=LLM_CONCURRENCY),
+        )
+        _llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+        _rate_limiter = TokenBucket(LLM_RPS, LLM_BURST)
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def post_completion_async(payload: dict) -> str:
+    """
+    Асинхронный запрос к completion API: не больше LLM_CONCURRENCY одновременно
+    и не чаще LLM_RPS в секунду. Попадания в response_cache не ждут лимитов.
+    """
+    key = response_cache.key(payload)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    client = get_async_client()
+    async with _llm_semaphore:
+        await _rate_limiter.acquire()
+        start = time.perf_counter()
+        response = await client.post(URL, json=payload)
+    if response.status_code != 200:
+        print(f"Status code: {response.status_code}")
+        print(f"Response content: {response.text}")
     response.raise_for_status()
-    return response.json()["result"]["alternatives"][0]["message"]["text"]
\ No newline at end of file
+    result = response.json()["result"]
+    text = result["alternatives"][0]["message"]["text"]
+    response_cache.put(key, text, time.perf_counter() - start, _usage_tokens(result))
+    return text
+
+
+async def generate_answer_for_git_async(prompt: str) -> str:
+    return await post_completion_async(_git_answer_payload(prompt))
+
+
+async def stream_completion_async(payload: dict) -> AsyncIterator[str]:
+    """
+    Потоковый запрос к completion API: отдаёт новые куски текста по мере генерации.
+    API присылает JSON-строки с накопленным текстом, поэтому отдаётся разница
+    с предыдущей строкой. Ответ из response_cache отдаётся одним куском.
+    """
+    key = response_cache.key(payload)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    payload = {**payload, "completionOptions": {**payload["completionOptions"], "stream": True}}
+    client = get_async_client()
+    text = ""
+    tokens = 0
+    async with _llm_semaphore:
+        await _rate_limiter.acquire()
+        start = time.perf_counter()
+        async with client.stream("POST", URL, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                print(f"Status code: {response.status_code}")
+                print(f"Response content: {response.text}")
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)["result"]
+                current = result["alternatives"][0]["message"]["text"]
+                if len(current) > len(text):
+                    yield current[len(text):]
+                text = current
+                tokens = _usage_tokens(result) or tokens
+    response_cache.put(key, text, time.perf_counter() - start, tokens)
+
+
+def generate_answer_for_git_stream(prompt: str) -> AsyncIterator[str]:
+    return stream_completion_async(_git_answer_payload(prompt))
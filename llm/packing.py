@@ -0,0 +1,61 @@
+import math
+import re
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели, с запасом вверх:
+    латинское слово ~ 4 символа на токен, кириллическое ~ 3,
+    каждый знак препинания/символ — отдельный токен.
+    """
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 3)
+    return tokens
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """
+    Обрезает текст так, чтобы его оценка не превышала budget.
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def first_fit_decreasing(items: Sequence[T], size: Callable[[T], int], capacity: int) -> List[List[T]]:
+    """
+    Раскладывает items по корзинам вместимостью capacity: от больших к меньшим,
+    каждый — в первую корзину, где хватает места. Число корзин не больше
+    11/9 от оптимума + 6/9. Предметы больше capacity получают отдельную корзину.
+    Внутри корзины исходный порядок items сохраняется.
+    """
+    order = sorted(range(len(items)), key=lambda i: size(items[i]), reverse=True)
+    bins: List[List[int]] = []
+    free: List[int] = []
+    for i in order:
+        s = size(items[i])
+        for b, room in enumerate(free):
+            if s <= room:
+                bins[b].append(i)
+                free[b] -= s
+                break
+        else:
+            bins.append([i])
+            free.append(capacity - s)
+    return [[items[i] for i in sorted(b)] for b in bins]
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ManifestRecord = Tuple[int, int, str]  # size, mtime (ns), hash
+
+HASH_CHUNK = 1 << 20
+
+
+def hash_file(path: Path) -> str:
+    """
+    Считает хеш содержимого файла (blake2b), читая его блоками.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_record(path: Path) -> Tuple[str, int, int, str]:
+    """
+    Запись манифеста для файла: (path, size, mtime, hash).
+    """
+    st = path.stat()
+    return str(path), st.st_size, st.st_mtime_ns, hash_file(path)
+
+
+def diff_manifest(
+    root_path: Path,
+    py_files: List[Path],
+    manifest: Dict[str, ManifestRecord],
+    full: bool = False,
+) -> Tuple[List[Path], List[Tuple[str, int, int, str]], List[str]]:
+    """
+    Сравнивает текущие файлы под root_path с сохранённым манифестом.
+
+    Возвращает:
+      - changed: файлы, которые нужно переразобрать (новые или изменённые);
+      - records: записи (path, size, mtime, hash) для обновления манифеста;
+      - deleted: пути из манифеста, которых больше нет на диске.
+
+    Хеш считается только когда size/mtime не совпали: файл, которого
+    лишь коснулись (touch), не переразбирается, но запись обновляется.
+    full=True помечает изменёнными все файлы.
+    """
+    changed: List[Path] = []
+    records: List[Tuple[str, int, int, str]] = []
+    seen = set()
+
+    for py_file in py_files:
+        key = str(py_file)
+        seen.add(key)
+        st = py_file.stat()
+        old = manifest.get(key)
+
+        if not full and old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            continue
+
+        digest = hash_file(py_file)
+        records.append((key, st.st_size, st.st_mtime_ns, digest))
+        if full or old is None or old[2] != digest:
+            changed.append(py_file)
+
+    prefix = str(root_path) + os.sep
+    deleted = [path for path in manifest if path.startswith(prefix) and path not in seen]
+
+    return changed, records, deleted
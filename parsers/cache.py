@@ -0,0 +1,62 @@
+import hashlib
+import marshal
+from dataclasses import fields
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+from disk_cache import DiskCache
+from parsers.entity import ParsedEntity
+
+# увеличивать при любом изменении вывода парсеров или полей ParsedEntity
+PARSER_VERSION = 3
+
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+# всё, кроме file: URI подставляется при чтении, поэтому одинаковое
+# содержимое по разным путям (или в разных ветках) попадает в одну запись
+_FIELDS = [f.name for f in fields(ParsedEntity) if f.name != "file"]
+
+
+class ParseCache(DiskCache):
+    """
+    Кеш вывода парсеров на диске, адресуемый содержимым файла.
+
+    Ключ — blake2b от версии и имени парсера и байтов файла, значение —
+    zlib(marshal(кортежи полей сущностей)). Хранение и вытеснение — DiskCache.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def key(self, parser: Callable, data: bytes) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{PARSER_VERSION}:{parser.__module__}.{parser.__qualname__}\0".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str, file_uri: str) -> Optional[List[ParsedEntity]]:
+        rows = self._load(key, marshal.loads)
+        if rows is None:
+            return None
+        self._touch(key)
+        return [ParsedEntity(file_uri, *row) for row in rows]
+
+    def put(self, key: str, entities: List[ParsedEntity]):
+        rows = [tuple(getattr(ent, name) for name in _FIELDS) for ent in entities]
+        self._store(key, marshal.dumps(rows))
+
+    def cached(self, parser: Callable[[Path], Iterator[ParsedEntity]], path: Path) -> Iterator[ParsedEntity]:
+        """
+        Сущности файла из кеша, а при промахе — от парсера с записью в кеш.
+        """
+        key = self.key(parser, path.read_bytes())
+        hit = self.get(key, path.as_uri())
+        if hit is not None:
+            yield from hit
+            return
+
+        entities = []
+        for ent in parser(path):
+            entities.append(ent)
+            yield ent
+        self.put(key, entities)
@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+@dataclass(slots=True)
+class ParsedEntity:
+    """
+    Класс или функция, извлечённые парсером.
+
+    Компактная замена вложенного словаря: URI файла один на все сущности файла,
+    имена интернируются, а id сущности и её методов собираются по требованию.
+    """
+    file: str
+    qualname: str  # "func", "Class" или "Class.method"
+    name: str
+    type: str
+    inherits: List[str] = field(default_factory=list)
+    calls: List[str] = field(default_factory=list)
+    methods: List[str] = field(default_factory=list)  # имена методов класса
+    comments: List[str] = field(default_factory=list)
+    start_line: int = 0
+    start_char: int = 0
+    end_line: int = 0
+    end_char: int = 0
+
+    @property
+    def id(self) -> str:
+        return f"{self.file}::{self.qualname}"
+
+    def method_ids(self) -> List[str]:
+        ent_id = self.id
+        return [f"{ent_id}.{m}" for m in self.methods]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Прежнее словарное представление (для JSON и отладки).
+        """
+        relations: Dict[str, List[str]] = {"calls": list(self.calls), "called_by": []}
+        if self.type == "class":
+            relations = {"methods": self.method_ids(), **relations}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "file": self.file,
+            "range": {
+                "start": {"line": self.start_line, "char": self.start_char},
+                "end": {"line": self.end_line, "char": self.end_char},
+            },
+            "inherits": list(self.inherits),
+            "relations": relations,
+            "comments": list(self.comments),
+        }
+
@@ -1,72 +1,130 @@
 import ast
-import io
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-import tokenize
-from typing import List, Dict
+import sys
+from typing import Iterator, List, Dict, Optional, Tuple
 
+from parsers.entity import ParsedEntity
 
-def parse_python(path: Path) -> List[Dict]:
 
+def parse_python(path: Path) -> List[ParsedEntity]:
+    return list(iter_python_entities(path))
+
+
+def _char_col(line: str, byte_col: int) -> int:
+    # col_offset в AST — смещение в байтах UTF-8
+    if line.isascii():
+        return byte_col
+    return len(line.encode("utf-8")[:byte_col].decode("utf-8", errors="ignore"))
+
+
+def iter_python_entities(path: Path) -> Iterator[ParsedEntity]:
+    """
+    Отдаёт сущности файла по мере обхода AST.
+    Сущность отдаётся, как только обойдено её тело, поэтому в памяти
+    держится только цепочка объемлющих классов/функций, а не весь список.
+
+    Комментарии собираются без отдельного прохода tokenize: строки с «#»
+    лежат в отсортированном индексе, и по завершении сущности её диапазон
+    строк вырезается из индекса через bisect. Обход идёт от вложенных
+    к внешним, поэтому комментарий достаётся самой внутренней сущности.
+    «#» внутри строковых литералов отсеивается по позициям литералов из AST.
+    """
     source = path.read_text(encoding="utf-8")
-    uri = path.as_uri()
+    uri = sys.intern(path.as_uri())
+
+    lines = source.split("\n")
+    hash_lines: List[int] = [ln for ln, text in enumerate(lines, 1) if "#" in text]
+    hash_line_set = set(hash_lines)
+    # строка -> промежутки [start, end) символов, занятые литералами, где может быть «#»
+    string_spans: Dict[int, List[Tuple[int, int]]] = {}
 
-    comment_map: Dict[int, str] = {}
-    for tok in tokenize.generate_tokens(io.StringIO(source).readline):
-        if tok.type == tokenize.COMMENT:
-            ln = tok.start[0]
-            txt = tok.string.lstrip("#").strip()
-            comment_map.setdefault(ln, []).append(txt)
+    def add_string_span(node: ast.expr):
+        if node.end_lineno is None:
+            return
+        for ln in range(node.lineno, node.end_lineno + 1):
+            if ln not in hash_line_set:
+                continue
+            text = lines[ln - 1]
+            start = _char_col(text, node.col_offset) if ln == node.lineno else 0
+            end = _char_col(text, node.end_col_offset) if ln == node.end_lineno else len(text)
+            string_spans.setdefault(ln, []).append((start, end))
 
-    entities: List[Dict] = []
+    def comment_on(ln: int) -> Optional[str]:
+        text = lines[ln - 1]
+        spans = string_spans.get(ln, ())
+        pos = text.find("#")
+        while pos != -1:
+            if not any(start <= pos < end for start, end in spans):
+                return text[pos:].lstrip("#").strip()
+            pos = text.find("#", pos + 1)
+        return None
 
-    class Analyzer(ast.NodeVisitor):
+    def take_comments(node: ast.AST) -> List[str]:
+        lo = bisect_left(hash_lines, node.lineno)
+        hi = bisect_right(hash_lines, node.end_lineno or node.lineno)
+        comments = [c for c in map(comment_on, hash_lines[lo:hi]) if c is not None]
+        # строки внутренних сущностей уже вырезаны, внешним они не достанутся
+        del hash_lines[lo:hi]
+
+        docstring = ast.get_docstring(node)
+        if docstring:
+            comments.insert(0, docstring)
+        return comments
+
+    def finish(entity: ParsedEntity, node: ast.AST):
+        entity.comments = take_comments(node)
+        entity.start_line = node.lineno
+        entity.start_char = _char_col(lines[node.lineno - 1], node.col_offset)
+        entity.end_line = node.end_lineno
+        entity.end_char = _char_col(lines[node.end_lineno - 1], node.end_col_offset)
+
+    class Analyzer:
         def __init__(self):
-            self.entities: List[Dict] = []
-            self.current_entity: Dict = None
+            self.current_entity: Optional[ParsedEntity] = None
+
+        def visit(self, node: ast.AST) -> Iterator[ParsedEntity]:
+            visitor = getattr(self, f"visit_{node.__class__.__name__}", self.generic_visit)
+            return visitor(node)
+
+        def generic_visit(self, node: ast.AST) -> Iterator[ParsedEntity]:
+            for child in ast.iter_child_nodes(node):
+                yield from self.visit(child)
 
         def visit_ClassDef(self, node: ast.ClassDef):
-            uri = path.as_uri()
-            entity = {
-                "id": f"{uri}::{node.name}",
-                "name": node.name,
-                "type": "class",
-                "file": uri,
-                "inherits": [
-                    base.id if isinstance(base, ast.Name) else ast.unparse(base)
+            name = sys.intern(node.name)
+            entity = ParsedEntity(
+                file=uri,
+                qualname=name,
+                name=name,
+                type="class",
+                inherits=[
+                    sys.intern(base.id if isinstance(base, ast.Name) else ast.unparse(base))
                     for base in node.bases
                 ],
-                "relations": {"methods": [], "calls": [], "called_by": []},
-            }
+            )
             prev = self.current_entity
             self.current_entity = entity
-            self.entities.append(entity)
-            self.generic_visit(node)
+            yield from self.generic_visit(node)
             self.current_entity = prev
+            finish(entity, node)
+            yield entity
 
         def visit_FunctionDef(self, node: ast.FunctionDef):
-            uri = path.as_uri()
-            if self.current_entity and self.current_entity.get("type") == "class":
+            name = sys.intern(node.name)
+            if self.current_entity and self.current_entity.type == "class":
                 parent = self.current_entity
-                qname = f"{parent['id']}.{node.name}"
-                parent["relations"]["methods"].append(qname)
-                ent_type = "function"
-                ent_id = qname
+                parent.methods.append(name)
+                qualname = f"{parent.qualname}.{name}"
             else:
-                ent_type = "function"
-                ent_id = f"{uri}::{node.name}"
-            entity = {
-                "id": ent_id,
-                "name": node.name,
-                "type": ent_type,
-                "file": uri,
-                "inherits": [],
-                "relations": {"calls": [], "called_by": []},
-            }
-            self.entities.append(entity)
+                qualname = name
+            entity = ParsedEntity(file=uri, qualname=qualname, name=name, type="function")
             prev = self.current_entity
             self.current_entity = entity
-            self.generic_visit(node)
+            yield from self.generic_visit(node)
             self.current_entity = prev
+            finish(entity, node)
+            yield entity
 
         def visit_Call(self, node: ast.Call):
             func = node.func
@@ -77,12 +135,17 @@ def parse_python(path: Path) -> List[Dict]:
             else:
                 name = ast.unparse(func)
             if self.current_entity:
-                self.current_entity["relations"]["calls"].append(name)
-            self.generic_visit(node)
-
-    Analyzer.visit(ast.parse(source))
+                self.current_entity.calls.append(sys.intern(name))
+            yield from self.generic_visit(node)
 
-    return entities
+        def visit_Constant(self, node: ast.Constant):
+            value = node.value
+            if (isinstance(value, str) and "#" in value) or (isinstance(value, bytes) and b"#" in value):
+                add_string_span(node)
+            return iter(())
 
+        def visit_JoinedStr(self, node: ast.JoinedStr):
+            add_string_span(node)
+            yield from self.generic_visit(node)
 
-result = parse_python(Path("parsers/pyparser.py").resolve())
+    yield from Analyzer().visit(ast.parse(source))
@@ -0,0 +1,100 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from dispatcher import iter_file_entities, parse_file
+from parsers.cache import ParseCache
+from parsers.entity import ParsedEntity
+from storage import BATCH_SIZE, BulkWriter
+
+QUEUE_SIZE = 8
+
+
+def batched(items: Iterable[ParsedEntity], size: int) -> Iterator[List[ParsedEntity]]:
+    """
+    Режет поток сущностей на куски фиксированного размера,
+    не обращая внимания на границы файлов.
+    """
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_entities(
+    paths: Iterable[Path],
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+) -> Iterator[ParsedEntity]:
+    """
+    Поток сущностей всех файлов в порядке paths.
+
+    При jobs > 1 файлы разбираются в пуле процессов, но в работе одновременно
+    не больше jobs * 4 файлов: результаты не копятся, если писатель не успевает.
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield from iter_file_entities(path, cache) or ()
+        return
+
+    window = jobs * 4
+    parse = partial(parse_file, cache=cache)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(parse, path))
+            if len(pending) >= window:
+                yield from pending.popleft().result() or ()
+        while pending:
+            yield from pending.popleft().result() or ()
+
+
+def run_pipeline(
+    paths: Iterable[Path],
+    db_path: str = 'db.sqlite',
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+):
+    """
+    Парсеры -> батчи по batch_size -> ограниченная очередь -> единственный писатель.
+
+    Писатель работает в отдельном потоке и владеет соединением с БД.
+    Когда очередь заполнена, разбор ждёт, поэтому в памяти не больше
+    queue_size батчей независимо от размера файлов и репозитория.
+    """
+    batches: queue.Queue = queue.Queue(maxsize=queue_size)
+    error: List[Optional[BaseException]] = [None]
+
+    def write():
+        try:
+            with BulkWriter(db_path, batch_size=batch_size) as writer:
+                while (batch := batches.get()) is not None:
+                    writer.add(batch)
+        except BaseException as e:
+            error[0] = e
+            # разгружаем очередь, чтобы производитель не завис на put
+            while batches.get() is not None:
+                pass
+
+    writer_thread = threading.Thread(target=write, name='bulk-writer')
+    writer_thread.start()
+    try:
+        for batch in batched(iter_entities(paths, jobs, cache), batch_size):
+            if error[0] is not None:
+                break
+            batches.put(batch)
+    finally:
+        batches.put(None)
+        writer_thread.join()
+
+    if error[0] is not None:
+        raise error[0]
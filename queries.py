@@ -0,0 +1,128 @@
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from storage import init_db
+
+DEFAULT_MAX_DEPTH = 5
+
+# В calls.callee_id и inherits.parent_id лежат имена (как они записаны в коде),
+# а не id сущностей, поэтому переход к следующему уровню идёт через entities.name.
+
+_CALLERS = text("SELECT DISTINCT caller_id FROM calls WHERE callee_id = :name ORDER BY caller_id")
+
+_CALLEES = text("SELECT DISTINCT callee_id FROM calls WHERE caller_id = :id ORDER BY callee_id")
+
+_SUBCLASSES = text("SELECT DISTINCT child_id FROM inherits WHERE parent_id = :name ORDER BY child_id")
+
+_METHODS_OF = text("SELECT method_id FROM methods WHERE class_id = :id ORDER BY method_id")
+
+_TRANSITIVE_CALLEES = text("""
+WITH RECURSIVE reach(id, depth) AS (
+    SELECT :id, 0
+    UNION
+    SELECT e.id, r.depth + 1
+    FROM reach r
+    JOIN calls c ON c.caller_id = r.id
+    JOIN entities e ON e.name = c.callee_id
+    WHERE r.depth < :max_depth
+)
+SELECT id, MIN(depth) AS depth FROM reach WHERE depth > 0 GROUP BY id ORDER BY depth, id
+""")
+
+_TRANSITIVE_CALLERS = text("""
+WITH RECURSIVE reach(id, depth) AS (
+    SELECT :id, 0
+    UNION
+    SELECT c.caller_id, r.depth + 1
+    FROM reach r
+    JOIN entities e ON e.id = r.id
+    JOIN calls c ON c.callee_id = e.name
+    WHERE r.depth < :max_depth
+)
+SELECT id, MIN(depth) AS depth FROM reach WHERE depth > 0 GROUP BY id ORDER BY depth, id
+""")
+
+_TRANSITIVE_SUBCLASSES = text("""
+WITH RECURSIVE reach(id, depth) AS (
+    SELECT child_id, 1 FROM inherits WHERE parent_id = :name
+    UNION
+    SELECT i.child_id, r.depth + 1
+    FROM reach r
+    JOIN entities e ON e.id = r.id
+    JOIN inherits i ON i.parent_id = e.name
+    WHERE r.depth < :max_depth
+)
+SELECT id, MIN(depth) AS depth FROM reach GROUP BY id ORDER BY depth, id
+""")
+
+
+def _scalars(query, db_path: str, **params) -> List[str]:
+    with init_db(db_path).connect() as conn:
+        return list(conn.execute(query, params).scalars())
+
+
+def _pairs(query, db_path: str, **params) -> List[Tuple[str, int]]:
+    with init_db(db_path).connect() as conn:
+        return [tuple(row) for row in conn.execute(query, params)]
+
+
+def callers(name: str, db_path: str = 'db.sqlite') -> List[str]:
+    """
+    id сущностей, вызывающих функцию/метод с именем name.
+    """
+    return _scalars(_CALLERS, db_path, name=name)
+
+
+def callees(entity_id: str, db_path: str = 'db.sqlite') -> List[str]:
+    """
+    Имена, которые вызывает сущность entity_id.
+    """
+    return _scalars(_CALLEES, db_path, id=entity_id)
+
+
+def subclasses(name: str, db_path: str = 'db.sqlite') -> List[str]:
+    """
+    id классов, напрямую наследующих класс с именем name.
+    """
+    return _scalars(_SUBCLASSES, db_path, name=name)
+
+
+def methods_of(class_id: str, db_path: str = 'db.sqlite') -> List[str]:
+    """
+    id методов класса class_id.
+    """
+    return _scalars(_METHODS_OF, db_path, id=class_id)
+
+
+def transitive_callees(
+    entity_id: str,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    db_path: str = 'db.sqlite',
+) -> List[Tuple[str, int]]:
+    """
+    Все сущности, достижимые из entity_id по вызовам, с минимальной глубиной (≤ max_depth).
+    """
+    return _pairs(_TRANSITIVE_CALLEES, db_path, id=entity_id, max_depth=max_depth)
+
+
+def transitive_callers(
+    entity_id: str,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    db_path: str = 'db.sqlite',
+) -> List[Tuple[str, int]]:
+    """
+    Все сущности, из которых по цепочке вызовов достижима entity_id, с минимальной глубиной.
+    """
+    return _pairs(_TRANSITIVE_CALLERS, db_path, id=entity_id, max_depth=max_depth)
+
+
+def transitive_subclasses(
+    name: str,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    db_path: str = 'db.sqlite',
+) -> List[Tuple[str, int]]:
+    """
+    Все потомки класса с именем name (через любое число уровней ≤ max_depth).
+    """
+    return _pairs(_TRANSITIVE_SUBCLASSES, db_path, name=name, max_depth=max_depth)
@@ -1,7 +1,23 @@
 import argparse
+import logging
 from pathlib import Path
+from typing import List, Optional, Tuple
 
-from dispatcher import dispatch_file
+import pygit2
+
+from gitmodule import checkout_repo, get_changed_paths
+from manifest import diff_manifest, file_record
+from parsers.cache import DEFAULT_MAX_BYTES, ParseCache
+from pipeline import run_pipeline
+from storage import (
+    get_index_state,
+    load_manifest,
+    purge_files,
+    set_index_state,
+    update_manifest,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def is_hidden(path: Path, root: Path) -> bool:
@@ -19,6 +35,52 @@ def is_hidden(path: Path, root: Path) -> bool:
     return any(part.startswith('.') for part in parts)
 
 
+def collect_python_files(root_path: Path) -> List[Path]:
+    """
+    Собирает все .py-файлы под root_path, кроме скрытых и самого runner.
+    Порядок фиксирован, чтобы последовательный и параллельный обход совпадали.
+    """
+    return [
+        py_file
+        for py_file in root_path.rglob("*.py")
+        if not is_hidden(py_file, root_path) and py_file.name != Path(__file__).name
+    ]
+
+
+def git_changes(
+    repo: pygit2.Repository,
+    root_path: Path,
+    last_commit: str,
+    head_commit: str,
+) -> Optional[Tuple[List[Path], List[Tuple[str, int, int, str]], List[str]]]:
+    """
+    Изменения .py-файлов под root_path между last_commit и HEAD по диффу деревьев git.
+    Возвращает то же, что diff_manifest, но без обхода и хеширования всего дерева;
+    None, если last_commit больше нет в репозитории.
+    """
+    try:
+        changed_rel, deleted_rel = get_changed_paths(repo, last_commit, head_commit)
+    except KeyError:
+        logger.warning(f"Commit {last_commit} not found, falling back to manifest scan")
+        return None
+
+    workdir = Path(repo.workdir).resolve()
+
+    def indexed(path: Path) -> bool:
+        return (
+            path.suffix == ".py"
+            and path.is_relative_to(root_path)
+            and not is_hidden(path, root_path)
+            and path.name != Path(__file__).name
+        )
+
+    changed = [workdir / rel for rel in changed_rel if indexed(workdir / rel)]
+    changed = [path for path in changed if path.is_file()]
+    deleted = [str(workdir / rel) for rel in deleted_rel if indexed(workdir / rel)]
+
+    return changed, [file_record(path) for path in changed], deleted
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Обходит все Python-файлы в указанном корне и вызывает dispatcher для каждого"
@@ -29,17 +91,74 @@ def main():
         default=".",
         help="Корневая директория для обхода (по умолчанию текущая)"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Число процессов для разбора файлов (по умолчанию 1 — без пула)"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Переиндексировать все файлы, игнорируя манифест"
+    )
+    parser.add_argument(
+        "--git",
+        action="store_true",
+        help="Брать изменения из диффа git между последним проиндексированным коммитом и HEAD"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=".beeline_cache",
+        help="Каталог кеша результатов парсера (по умолчанию .beeline_cache)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        help="Предельный размер кеша парсера в МБ"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Не использовать кеш результатов парсера"
+    )
     args = parser.parse_args()
 
     root_path = Path(args.root).resolve()
     if not root_path.is_dir():
         parser.error(f"Указанный путь '{args.root}' не является директорией")
+    if args.jobs < 1:
+        parser.error("--jobs должен быть положительным числом")
+
+    state_key = f"git_head:{root_path}"
+    head_commit = None
+    changes = None
+    if args.git:
+        with checkout_repo(str(root_path)) as repo:
+            head_commit = str(repo.head.target)
+            last_commit = get_index_state(state_key)
+            if last_commit and not args.full:
+                changes = git_changes(repo, root_path, last_commit, head_commit)
+
+    if changes is None:
+        # пропускаем неизменённые файлы, старые строки изменённых и удалённых вычищаем
+        changes = diff_manifest(
+            root_path, collect_python_files(root_path), load_manifest(), full=args.full
+        )
+    changed, records, deleted = changes
+    purge_files(deleted + [str(p) for p in changed])
+
+    cache = None if args.no_cache else ParseCache(args.cache_dir, args.cache_size * 2**20)
+
+    # разбор (в пуле процессов при --jobs > 1) -> батчи -> единственный писатель
+    run_pipeline(changed, jobs=args.jobs, cache=cache)
 
-    for py_file in root_path.rglob("*.py"):
-        # игнорируем скрытые файлы/папки и сам runner
-        if is_hidden(py_file, root_path) or py_file.name == Path(__file__).name:
-            continue
-        dispatch_file(py_file)
+    update_manifest(records)
+    if head_commit is not None:
+        set_index_state(state_key, head_commit)
+    if cache is not None:
+        cache.evict()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,23 @@
-import os
-from typing import List, Dict, Any
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple, Set
 
 from sqlalchemy import (
     create_engine,
+    event,
     Column,
     Integer,
     Text,
     ForeignKey,
+    Index,
     JSON,
+    delete,
+    select,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import relationship
+
+from parsers.entity import ParsedEntity
 
 Base = declarative_base()
 
@@ -28,9 +35,15 @@ class Entity(Base):
 
     inherits = relationship('Inherit', back_populates='child', cascade='all, delete-orphan')
     calls_made = relationship('Call', back_populates='caller', cascade='all, delete-orphan', foreign_keys='Call.caller_id')
-    calls_received = relationship('Call', back_populates='callee', cascade='all, delete-orphan', foreign_keys='Call.callee_id')
+    calls_received = relationship('Call', back_populates='callee', cascade='all, delete-orphan', primaryjoin='Entity.id == foreign(Call.callee_id)')
     methods = relationship('Method', back_populates='klass', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # интервальный индекс: сущности файла по диапазонам строк
+        Index('ix_entities_file_lines', 'file', 'start_line', 'end_line', 'id'),
+        Index('ix_entities_name', 'name', 'id'),
+    )
+
 class Inherit(Base):
     __tablename__ = 'inherits'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -39,6 +52,11 @@ class Inherit(Base):
 
     child = relationship('Entity', back_populates='inherits')
 
+    __table_args__ = (
+        Index('ix_inherits_child_parent', 'child_id', 'parent_id'),
+        Index('ix_inherits_parent_child', 'parent_id', 'child_id'),
+    )
+
 class Call(Base):
     __tablename__ = 'calls'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -46,7 +64,14 @@ class Call(Base):
     callee_id = Column(Text, nullable=False)
 
     caller = relationship('Entity', back_populates='calls_made', foreign_keys=[caller_id])
-    callee = relationship('Entity', back_populates='calls_received', foreign_keys=[callee_id])
+    # callee_id может быть и голым именем, поэтому без ForeignKey
+    callee = relationship('Entity', back_populates='calls_received', primaryjoin='foreign(Call.callee_id) == Entity.id')
+
+    __table_args__ = (
+        # покрывающие индексы: «кого вызывает X» и «кто вызывает X» без чтения таблицы
+        Index('ix_calls_caller_callee', 'caller_id', 'callee_id'),
+        Index('ix_calls_callee_caller', 'callee_id', 'caller_id'),
+    )
 
 class Method(Base):
     __tablename__ = 'methods'
@@ -56,64 +81,223 @@ class Method(Base):
 
     klass = relationship('Entity', back_populates='methods')
 
+    __table_args__ = (
+        Index('ix_methods_class_method', 'class_id', 'method_id'),
+    )
+
+class FileManifest(Base):
+    __tablename__ = 'file_manifest'
+    path = Column(Text, primary_key=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Integer, nullable=False)  # st_mtime_ns
+    hash = Column(Text, nullable=False)
+
+class IndexState(Base):
+    __tablename__ = 'index_state'
+    key = Column(Text, primary_key=True)
+    value = Column(Text, nullable=False)
+
+
+BATCH_SIZE = 5000
+
+_ENGINES: Dict[str, Engine] = {}
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    # WAL + synchronous=NORMAL: fsync только на checkpoint, читатели не блокируют запись
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
+def init_db(db_path: str = 'db.sqlite') -> Engine:
+    """
+    Возвращает engine для БД, создавая его и схему один раз на процесс.
+    """
+    engine = _ENGINES.get(db_path)
+    if engine is not None:
+        return engine
 
-def init_db(db_path: str = 'db.sqlite'):
-    if db_path != ':memory:' and os.path.exists(db_path):
-        pass
     engine = create_engine(f'sqlite:///{db_path}', echo=False)
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
     Base.metadata.create_all(engine)
+    # create_all не добавляет индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    _ENGINES[db_path] = engine
     return engine
 
 
-def save_entities(entities: List[Dict[str, Any]], db_path: str = 'db.sqlite'):
-    """
-    Сохраняет список сущностей и их связей в SQLite БД.
-
-    entities: список словарей с ключами:
-      - id, name, type, file,
-        range: {start: {line, char}, end: {line, char}},
-      - inherits: [parent1, parent2, ...],
-      - relations: {methods: [...], calls: [...]}
-    """
-    engine = init_db(db_path)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    for ent in entities:
-        # вставка сущности
-        ent_id = ent['id']
-        range_ = ent.get('range', {})
-        start = range_.get('start', {})
-        end = range_.get('end', {})
-        comments = ent.get("comments", [])
-        if ent["type"] in ("class", "function"):
-            entity = Entity(
-            id=ent_id,
-            name=ent.get('name', ''),
-            type=ent.get('type', ''),
-            file=ent.get('file', ''),
-            start_line=start.get('line', 0),
-            start_char=start.get('char', 0),
-            end_line=end.get('line', 0),
-            end_char=end.get('char', 0),
-            comments=comments,
-            )
-            session.merge(entity)
-
-        # наследования
-        for parent in ent.get('inherits', []):
-            inh = Inherit(child_id=ent_id, parent_id=parent)
-            session.add(inh)
-
-        # методы
-        for m in ent.get('relations', {}).get('methods', []):
-            method = Method(class_id=ent_id, method_id=m)
-            session.add(method)
-
-        # вызовы
-        for c in ent.get('relations', {}).get('calls', []):
-            call = Call(caller_id=ent_id, callee_id=c)
-            session.add(call)
-
-    session.commit()
-    session.close()
+def delete_file_entities(conn, file_uri: str):
+    """
+    Удаляет сущности файла вместе с их наследованиями, методами и вызовами.
+    """
+    entities = Entity.__table__
+    ids = select(entities.c.id).where(entities.c.file == file_uri)
+    conn.execute(delete(Inherit.__table__).where(Inherit.__table__.c.child_id.in_(ids)))
+    conn.execute(delete(Method.__table__).where(Method.__table__.c.class_id.in_(ids)))
+    conn.execute(delete(Call.__table__).where(Call.__table__.c.caller_id.in_(ids)))
+    conn.execute(delete(entities).where(entities.c.file == file_uri))
+
+
+class BulkWriter:
+    """
+    Пакетная запись сущностей: один engine и одно соединение на прогон,
+    executemany-вставки и одна транзакция на батч.
+
+    Связи заменяются идемпотентно: при первой встрече файла в прогоне
+    его старые строки удаляются, поэтому повторный запуск не дублирует рёбра.
+    """
+
+    def __init__(self, db_path: str = 'db.sqlite', batch_size: int = BATCH_SIZE):
+        self.engine = init_db(db_path)
+        self.conn = self.engine.connect()
+        self.batch_size = batch_size
+
+        self._seen_files: Set[str] = set()
+        self._purge: List[str] = []
+        self._entities: List[Dict[str, Any]] = []
+        self._inherits: List[Dict[str, Any]] = []
+        self._methods: List[Dict[str, Any]] = []
+        self._calls: List[Dict[str, Any]] = []
+        self._pending = 0
+
+    def __enter__(self) -> 'BulkWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        self.conn.close()
+
+    def add(self, entities: Iterable[ParsedEntity]):
+        for ent in entities:
+            self._add_entity(ent)
+            if self._pending >= self.batch_size:
+                self.flush()
+
+    def _add_entity(self, ent: ParsedEntity):
+        ent_id = ent.id
+        file = ent.file
+        if file not in self._seen_files:
+            self._seen_files.add(file)
+            self._purge.append(file)
+
+        if ent.type in ('class', 'function'):
+            self._entities.append({
+                'id': ent_id,
+                'name': ent.name,
+                'type': ent.type,
+                'file': file,
+                'start_line': ent.start_line,
+                'start_char': ent.start_char,
+                'end_line': ent.end_line,
+                'end_char': ent.end_char,
+                'comments': ent.comments,
+            })
+
+        self._inherits.extend({'child_id': ent_id, 'parent_id': p} for p in ent.inherits)
+        self._methods.extend({'class_id': ent_id, 'method_id': m} for m in ent.method_ids())
+        self._calls.extend({'caller_id': ent_id, 'callee_id': c} for c in ent.calls)
+        self._pending = len(self._entities) + len(self._inherits) + len(self._methods) + len(self._calls)
+
+    def flush(self):
+        if not (self._purge or self._entities or self._inherits or self._methods or self._calls):
+            return
+
+        with self.conn.begin():
+            for file_uri in self._purge:
+                delete_file_entities(self.conn, file_uri)
+            if self._entities:
+                self.conn.execute(Entity.__table__.insert().prefix_with('OR REPLACE'), self._entities)
+            if self._inherits:
+                self.conn.execute(Inherit.__table__.insert(), self._inherits)
+            if self._methods:
+                self.conn.execute(Method.__table__.insert(), self._methods)
+            if self._calls:
+                self.conn.execute(Call.__table__.insert(), self._calls)
+
+        self._purge = []
+        self._entities = []
+        self._inherits = []
+        self._methods = []
+        self._calls = []
+        self._pending = 0
+
+
+def save_entities(entities: Iterable[ParsedEntity], db_path: str = 'db.sqlite'):
+    """
+    Сохраняет сущности (ParsedEntity) и их связи в SQLite БД.
+    Прежние строки того же файла заменяются.
+    """
+    with BulkWriter(db_path) as writer:
+        writer.add(entities)
+
+
+def load_manifest(db_path: str = 'db.sqlite') -> Dict[str, Tuple[int, int, str]]:
+    """
+    Загружает манифест проиндексированных файлов: path -> (size, mtime, hash).
+    """
+    manifest = FileManifest.__table__
+    with init_db(db_path).connect() as conn:
+        rows = conn.execute(
+            select(manifest.c.path, manifest.c.size, manifest.c.mtime, manifest.c.hash)
+        )
+        return {path: (size, mtime, hash_) for path, size, mtime, hash_ in rows}
+
+
+def purge_files(paths: Iterable[str], db_path: str = 'db.sqlite'):
+    """
+    Убирает из БД всё, что было извлечено из указанных файлов, и их записи в манифесте.
+    """
+    manifest = FileManifest.__table__
+    with init_db(db_path).begin() as conn:
+        for path in paths:
+            delete_file_entities(conn, Path(path).as_uri())
+            conn.execute(delete(manifest).where(manifest.c.path == path))
+
+
+def update_manifest(records: Iterable[Tuple[str, int, int, str]], db_path: str = 'db.sqlite'):
+    """
+    Записывает (path, size, mtime, hash) проиндексированных файлов в манифест.
+    """
+    rows = [
+        {'path': path, 'size': size, 'mtime': mtime, 'hash': hash_}
+        for path, size, mtime, hash_ in records
+    ]
+    if not rows:
+        return
+    with init_db(db_path).begin() as conn:
+        conn.execute(FileManifest.__table__.insert().prefix_with('OR REPLACE'), rows)
+
+
+def get_index_state(key: str, db_path: str = 'db.sqlite') -> Optional[str]:
+    state = IndexState.__table__
+    with init_db(db_path).connect() as conn:
+        return conn.execute(select(state.c.value).where(state.c.key == key)).scalar()
+
+
+def set_index_state(key: str, value: str, db_path: str = 'db.sqlite'):
+    with init_db(db_path).begin() as conn:
+        conn.execute(
+            IndexState.__table__.insert().prefix_with('OR REPLACE'),
+            {'key': key, 'value': value},
+        )
+
+
+def load_file_intervals(file_uri: str, db_path: str = 'db.sqlite') -> List[Tuple[int, int, str]]:
+    """
+    Диапазоны строк (start_line, end_line, id) всех сущностей файла.
+    """
+    entities = Entity.__table__
+    query = (
+        select(entities.c.start_line, entities.c.end_line, entities.c.id)
+        .where(entities.c.file == file_uri)
+        .order_by(entities.c.start_line)
+    )
+    with init_db(db_path).connect() as conn:
+        return [tuple(row) for row in conn.execute(query)]
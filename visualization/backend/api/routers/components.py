@@ -1,4 +1,3 @@
-import shutil
 import tempfile
 import zipfile
 import aiofiles
@@ -7,7 +6,7 @@ from fastapi.responses import JSONResponse, FileResponse
 from pathlib import Path
 import httpx
 
-from llm.generate import generate_docs, generate_module_docs, generate_overview_docs, zip_docs
+from llm.generate import generate_docs_async, generate_module_docs_async, generate_overview_docs_async, response_cache, zip_docs
 
 
 router = APIRouter(prefix="/components", tags=["components"])
@@ -22,21 +21,21 @@ async def upload_and_extract(
     и возвращаем docs_upd.zip из корня проекта
     """
     try:
-        # Очищаем папку content перед обработкой
+        # папка content не очищается: по манифесту docs перегенерируются только изменившиеся файлы и модули
         content_dir = Path(__file__).parent.parent.parent.parent.parent / "content"
-        if content_dir.exists():
-            shutil.rmtree(content_dir)
-        content_dir.mkdir()
+        content_dir.mkdir(exist_ok=True)
         # Путь к ZIP-файлу в корне проекта
         # zip_path = Path(__file__).parent.parent.parent.parent.parent / "docs_upd.zip"
-        generate_docs(zip_file)
+        await generate_docs_async(zip_file)
 
-        generate_module_docs()
+        await generate_module_docs_async()
 
-        generate_overview_docs()
+        await generate_overview_docs_async()
 
         filepath = zip_docs()
 
+        response_cache.evict()
+
         if not filepath.exists():
             raise HTTPException(status_code=404, detail="docs_upd.zip не найден")
 
@@ -58,6 +57,14 @@ async def upload_and_extract(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/llm_cache_stats/")
+async def llm_cache_stats() -> JSONResponse:
+    """
+    Попадания и промахи кеша ответов LLM, сэкономленные секунды и токены
+    """
+    return JSONResponse(response_cache.snapshot())
+
+
 # @router.post("/download_and_extract/")
 # async def download_and_extract(
 #     repo_url: str = Query(..., description="HTTPS-ссылка на GitHub-репозиторий"),
@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
-from visualization.backend.services import gitmodule
-from llm.generate import generate_answer_for_git
+from typing import List, Optional
+from visualization.backend.services import cochange, gitmodule
+from visualization.backend.services.workers import run_git
+from llm.generate import generate_answer_for_git_async, generate_answer_for_git_stream
+from intervals import IntervalIndexCache
+import json
 import os
 
 router = APIRouter(
@@ -10,10 +14,14 @@ router = APIRouter(
     tags=["git-analysis"]
 )
 
+# индекс сущностей из БД индексатора (runner.py): файл + строка -> диапазон функции
+entity_index = IntervalIndexCache(os.getenv("INDEX_DB_PATH", "db.sqlite"))
+
 class FunctionAnalysisRequest(BaseModel):
     file_path: str
-    start_line: int
-    end_line: int
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    line: Optional[int] = None  # вместо start_line/end_line: любая строка внутри функции
 
 class FunctionAnalysisResponse(BaseModel):
     commits: List[dict]
@@ -22,54 +30,99 @@ class FunctionAnalysisResponse(BaseModel):
 
 @router.post("/analyze-function")
 async def analyze_function(request: FunctionAnalysisRequest):
+    # git-часть блокирует и идёт в пуле потоков, запрос к LLM — асинхронный
+    llm_prompt = await run_git(build_function_prompt, request)
+    try:
+        return await generate_answer_for_git_async(llm_prompt)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/analyze-function/stream")
+async def analyze_function_stream(request: FunctionAnalysisRequest):
+    """
+    То же, что /analyze-function, но ответ модели приходит как Server-Sent Events:
+    каждый кусок текста — событие с JSON-строкой в data, в конце — событие done,
+    при ошибке во время генерации — событие error.
+    """
+    # ошибки подготовки (422/404/500) возвращаются обычным ответом, до начала потока
+    llm_prompt = await run_git(build_function_prompt, request)
+
+    async def events():
+        try:
+            async for chunk in generate_answer_for_git_stream(llm_prompt):
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e), ensure_ascii=False)}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def build_function_prompt(request: FunctionAnalysisRequest) -> str:
+    if request.start_line is None or request.end_line is None:
+        if request.line is None:
+            raise HTTPException(status_code=422, detail="Specify start_line and end_line, or line")
+        found = entity_index.enclosing(request.file_path, request.line)
+        if found is None:
+            raise HTTPException(status_code=404, detail="No indexed function or class encloses the specified line")
+        request.start_line, request.end_line, _ = found
+
     try:
         # Get repository path (assuming the file is in the workspace)
         repo_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(request.file_path))))
         
         # Get repository
-        repo = gitmodule.get_repo(repo_path)
+        with gitmodule.checkout_repo(repo_path) as repo:
         
-        # Get relative file path
-        relative_file_path = os.path.relpath(request.file_path, repo_path)
+            # Get relative file path
+            relative_file_path = os.path.relpath(request.file_path, repo_path)
         
-        # Get commit IDs for the specified lines
-        commit_ids = gitmodule.get_commit_ids_for_lines(
-            repo,
-            relative_file_path,
-            request.start_line,
-            request.end_line
-        )
+            # Get commit IDs for the specified lines
+            commit_ids = gitmodule.get_commit_ids_for_lines(
+                repo,
+                relative_file_path,
+                request.start_line,
+                request.end_line
+            )
         
-        if not commit_ids:
-            raise HTTPException(status_code=404, detail="No commits found for the specified function lines")
+            if not commit_ids:
+                raise HTTPException(status_code=404, detail="No commits found for the specified function lines")
         
-        # Get commit metadata
-        commits_meta = gitmodule.get_information_for_commits(repo, commit_ids)
+            # Get commit metadata
+            commits_meta = gitmodule.get_information_for_commits(repo, commit_ids)
         
-        # Compute coupling
-        coupling = gitmodule.compute_coupling(
-            commits_meta,
-            relative_file_path,
-            top_n=10
-        )
+            # Compute coupling: по всей истории из матрицы co-change, пока она строится — по коммитам blame
+            coupling = cochange.coupling_for(repo, relative_file_path, top_n=10)
+            if coupling is None:
+                coupling = gitmodule.compute_coupling(
+                    commits_meta,
+                    relative_file_path,
+                    top_n=10
+                )
         
-        # Build LLM prompt
-        target = {
-            "file": relative_file_path,
-            "start": request.start_line,
-            "end": request.end_line
-        }
+            # Build LLM prompt
+            target = {
+                "file": relative_file_path,
+                "start": request.start_line,
+                "end": request.end_line
+            }
         
-        llm_prompt = gitmodule.build_llm_prompt(
-            target,
-            commits_meta,
-            coupling,
-            max_commits=3,
-            max_coupled=10,
-            max_recommendations=5
-        )
+            llm_prompt = gitmodule.build_llm_prompt(
+                target,
+                commits_meta,
+                coupling,
+                max_commits=3,
+                max_coupled=10,
+                max_recommendations=5
+            )
         
-        return generate_answer_for_git(llm_prompt)
+            return llm_prompt
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from visualization.backend.db.database import Base
 from visualization.backend.api.routers.components import router as components_router
 from visualization.backend.api.routers.git_analysis import router as git_analysis_router
+from llm.generate import close_async_client
 
 
 
@@ -25,6 +26,7 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     yield
+    await close_async_client()
     # Завершение: удаление всех таблиц при завершении работы приложения
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
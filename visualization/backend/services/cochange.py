@@ -0,0 +1,188 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import closing
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pygit2
+
+from visualization.backend.services import history_miner
+from visualization.backend.services.gitmodule import commit_paths, is_service_commit
+
+logger = logging.getLogger(__name__)
+
+# коммиты, задевшие больше файлов (массовые переименования, форматирование),
+# не дают осмысленных пар и раздувают матрицу квадратично
+MAX_FILES_PER_COMMIT = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cochange (
+    file_a TEXT NOT NULL,
+    file_b TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (file_a, file_b)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def count_pairs(paths_per_commit: Iterable[List[str]], max_files: int = MAX_FILES_PER_COMMIT) -> Counter:
+    """
+    Счётчик упорядоченных пар (a, b), a != b, изменённых в одном коммите.
+    Хранятся обе пары, чтобы строка матрицы читалась по одному ключу.
+    """
+    pairs: Counter = Counter()
+    for paths in paths_per_commit:
+        if len(paths) > max_files:
+            continue
+        for a in paths:
+            for b in paths:
+                if a != b:
+                    pairs[(a, b)] += 1
+    return pairs
+
+
+def count_slice(repo: pygit2.Repository, commits: List[pygit2.Commit], max_files: int = MAX_FILES_PER_COMMIT) -> Tuple[Counter, int]:
+    """
+    Счётчик пар по срезу истории и число учтённых коммитов (без merge и служебных).
+    """
+    paths = [commit_paths(c) for c in commits if len(c.parents) <= 1 and not is_service_commit(c)]
+    return count_pairs(paths, max_files), len(paths)
+
+
+class CoChangeMatrix:
+    """
+    Разреженная матрица совместных изменений файлов по всей истории, в SQLite.
+
+    update() проходит только коммиты, появившиеся после последнего обхода,
+    и добавляет их пары к счётчикам; coupling() читает одну строку матрицы
+    по первичному ключу. У каждого потока своё соединение с базой.
+    """
+
+    def __init__(self, db_path: str, max_files: int = MAX_FILES_PER_COMMIT):
+        self.db_path = db_path
+        self.max_files = max_files
+        self._update_lock = threading.Lock()
+        self._local = threading.local()
+        # WAL хранится в самом файле базы, поэтому включается один раз при создании
+        with closing(sqlite3.connect(db_path)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+        return conn
+
+    @property
+    def mined_head(self) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM state WHERE key = 'head'").fetchone()
+        return row[0] if row else None
+
+    def update(self, repo: pygit2.Repository, jobs: int = history_miner.MINE_JOBS) -> int:
+        """
+        Добирает в матрицу коммиты от последнего обхода до HEAD.
+        Срезы истории разбираются в jobs процессах, их счётчики складываются здесь.
+        Всё пишется одной транзакцией вместе с новым HEAD, поэтому
+        прерванный обход не задваивает счётчики.
+        Возвращает число обработанных коммитов.
+        """
+        with self._update_lock, self._conn() as conn:
+            head = repo.head.target
+            row = conn.execute("SELECT value FROM state WHERE key = 'head'").fetchone()
+            last = row[0] if row else None
+            if last == str(head):
+                return 0
+
+            try:
+                shas = history_miner.commit_range(repo, last)
+            except (KeyError, ValueError, pygit2.GitError):
+                # история переписана — считаем заново
+                logger.warning(f"Mined head {last} is not in HEAD history, rebuilding co-change matrix")
+                conn.execute("DELETE FROM cochange")
+                shas = history_miner.commit_range(repo)
+
+            processed = 0
+            worker = partial(count_slice, max_files=self.max_files)
+            for pairs, n in history_miner.map_slices(repo, shas, worker, jobs):
+                self._add(conn, pairs)
+                processed += n
+
+            conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('head', ?)", (str(head),))
+            logger.info(f"Co-change matrix: mined {processed} commits up to {str(head)[:7]}")
+            return processed
+
+    def _add(self, conn: sqlite3.Connection, pairs: Counter):
+        if not pairs:
+            return
+        conn.executemany(
+            "INSERT INTO cochange (file_a, file_b, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (file_a, file_b) DO UPDATE SET count = count + excluded.count",
+            ((a, b, n) for (a, b), n in pairs.items()),
+        )
+
+    def update_in_background(self, repo_path: str, head: Optional[str] = None) -> Optional[threading.Thread]:
+        """
+        Запускает update() в отдельном потоке со своим Repository,
+        если обновление ещё не идёт и матрица отстаёт от head (если он задан).
+        """
+        if self._update_lock.locked() or (head is not None and head == self.mined_head):
+            return None
+
+        def run():
+            try:
+                self.update(pygit2.Repository(repo_path))
+            except Exception:
+                logger.exception(f"Co-change mining failed for {repo_path}")
+
+        thread = threading.Thread(target=run, name="cochange-miner", daemon=True)
+        thread.start()
+        return thread
+
+    def coupling(self, target_file: str, top_n: int = 10) -> List[Dict]:
+        """
+        Файлы, чаще всего менявшиеся вместе с target_file, в формате compute_coupling.
+        """
+        rows = self._conn().execute(
+            "SELECT file_b, count FROM cochange WHERE file_a = ? ORDER BY count DESC, file_b LIMIT ?",
+            (target_file, top_n),
+        ).fetchall()
+        return [{"file": f, "count": count} for f, count in rows]
+
+
+_matrices: Dict[str, CoChangeMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def get_matrix(repo: pygit2.Repository) -> CoChangeMatrix:
+    """
+    Матрица репозитория; файл лежит в его .git (beeline_cochange.sqlite).
+    """
+    db_path = os.path.join(repo.path, "beeline_cochange.sqlite")
+    with _matrices_lock:
+        matrix = _matrices.get(db_path)
+        if matrix is None:
+            matrix = _matrices[db_path] = CoChangeMatrix(db_path)
+        return matrix
+
+
+def coupling_for(repo: pygit2.Repository, target_file: str, top_n: int = 10) -> Optional[List[Dict]]:
+    """
+    Coupling по всей истории, если матрица уже построена; иначе None.
+    Если HEAD ушёл вперёд с прошлого обхода, запускает фоновое дообновление матрицы.
+    """
+    matrix = get_matrix(repo)
+    # состояние читается один раз на запрос и идёт в обе проверки
+    mined_head = matrix.mined_head
+    if mined_head != str(repo.head.target):
+        matrix.update_in_background(repo.workdir or repo.path)
+    if mined_head is None:
+        return None
+    return matrix.coupling(target_file, top_n)
@@ -0,0 +1,82 @@
+"""
+Параллельный обход истории: диапазон коммитов режется на топологические
+срезы, каждый срез обрабатывается в отдельном процессе со своим
+pygit2.Repository, частичные результаты возвращаются в порядке срезов.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Sequence, TypeVar
+
+import pygit2
+
+T = TypeVar("T")
+
+MINE_JOBS = int(os.getenv("MINE_JOBS", str(os.cpu_count() or 1)))
+SLICES_PER_JOB = 4
+# верхняя граница среза: частичный результат не должен разрастаться
+MAX_SLICE = 2000
+# меньше — разбираем в текущем процессе: запуск spawn-пула (импорт numpy
+# и pygit2 в каждом процессе) дороже самого разбора нескольких коммитов
+MIN_PARALLEL_COMMITS = 500
+
+
+def commit_range(repo: pygit2.Repository, since: Optional[str] = None) -> List[str]:
+    """
+    SHA коммитов от since (не включая) до HEAD, от старых к новым в топологическом порядке.
+    ValueError/GitError, если since нет в репозитории или он не предок HEAD
+    (история переписана: после force-push старый коммит обычно ещё лежит
+    в базе объектов, и hide() по нему молча отрезал бы не ту часть истории).
+    """
+    head = repo.head.target
+    walker = repo.walk(head, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_REVERSE)
+    if since is not None:
+        since_oid = pygit2.Oid(hex=since)
+        if since_oid != head and not repo.descendant_of(head, since_oid):
+            raise ValueError(f"{since} is not an ancestor of HEAD")
+        walker.hide(since_oid)
+    return [str(commit.id) for commit in walker]
+
+
+def split(shas: Sequence[str], jobs: int) -> List[Sequence[str]]:
+    """
+    Подряд идущие срезы примерно равной длины: не меньше jobs * SLICES_PER_JOB
+    (чтобы выровнять нагрузку) и не длиннее MAX_SLICE.
+    """
+    if not shas:
+        return []
+    n = max(jobs * SLICES_PER_JOB, -(-len(shas) // MAX_SLICE))
+    size = -(-len(shas) // n)
+    return [shas[i:i + size] for i in range(0, len(shas), size)]
+
+
+def _run_slice(worker: Callable[[pygit2.Repository, List[pygit2.Commit]], T], repo_path: str, shas: Sequence[str]) -> T:
+    repo = pygit2.Repository(repo_path)
+    return worker(repo, [repo[sha] for sha in shas])
+
+
+def map_slices(
+    repo: pygit2.Repository,
+    shas: Sequence[str],
+    worker: Callable[[pygit2.Repository, List[pygit2.Commit]], T],
+    jobs: int = MINE_JOBS,
+) -> Iterator[T]:
+    """
+    worker(repo, commits) по каждому срезу shas; результаты отдаются в порядке срезов.
+
+    При jobs > 1 и не меньше MIN_PARALLEL_COMMITS коммитах срезы идут в пул процессов,
+    иначе (например, дообновление на пару новых коммитов) — в текущем процессе.
+    worker должен быть функцией уровня модуля (её передают в дочерний процесс
+    через pickle). Процессы запускаются через spawn:
+    вызывающий код обычно многопоточный (пул git-запросов), и fork в нём небезопасен.
+    """
+    if jobs <= 1 or len(shas) < MIN_PARALLEL_COMMITS:
+        for part in split(shas, 1):
+            yield worker(repo, [repo[sha] for sha in part])
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        futures = [pool.submit(_run_slice, worker, repo.path, part) for part in split(shas, jobs)]
+        for future in futures:
+            yield future.result()
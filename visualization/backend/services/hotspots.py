@@ -0,0 +1,305 @@
+"""
+Таблица изменений «коммит × файл» по всей истории и метрики горячих точек над ней.
+
+Таблица колоночная: для каждой пары (коммит, файл) — индексы и число
+добавленных/удалённых строк в массивах NumPy. Метрики по файлам считаются
+через bincount/unique без циклов по коммитам. Таблица хранится в .git
+(beeline_history.npz) и дополняется только новыми коммитами.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pygit2
+
+from visualization.backend.services import history_miner
+from visualization.backend.services.gitmodule import is_service_commit
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "beeline_history.npz"
+DEFAULT_HALF_LIFE_DAYS = 90.0
+
+
+@dataclass
+class ChangeTable:
+    """
+    Колонки по коммитам: shas, times (unix-время), authors (индекс в author_names).
+    Колонки по изменениям: commit_idx, file_idx (индекс в paths), added, deleted.
+    """
+    head: Optional[str] = None
+    shas: List[str] = field(default_factory=list)
+    times: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    authors: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+    author_names: List[str] = field(default_factory=list)
+    paths: List[str] = field(default_factory=list)
+    commit_idx: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+    file_idx: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+    added: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+    deleted: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int32))
+
+    def __len__(self) -> int:
+        return len(self.commit_idx)
+
+    @classmethod
+    def concat(cls, tables: Sequence["ChangeTable"], head: Optional[str] = None) -> "ChangeTable":
+        """
+        Склейка таблиц по порядку за один проход: словари путей и авторов
+        объединяются один раз, индексы каждой части переводятся через свой
+        массив-отображение, колонки склеиваются одним np.concatenate.
+        head по умолчанию — последний заданный head частей.
+        """
+        if head is None:
+            head = next((t.head for t in reversed(tables) if t.head), None)
+        if not tables:
+            return cls(head=head)
+
+        path_ids: Dict[str, int] = {}
+        author_ids: Dict[str, int] = {}
+        shas: List[str] = []
+        authors, commit_idx, file_idx = [], [], []
+        for t in tables:
+            path_map = np.array([path_ids.setdefault(p, len(path_ids)) for p in t.paths], np.int32)
+            author_map = np.array([author_ids.setdefault(a, len(author_ids)) for a in t.author_names], np.int32)
+            authors.append(author_map[t.authors])
+            file_idx.append(path_map[t.file_idx])
+            commit_idx.append((t.commit_idx + len(shas)).astype(np.int32))
+            shas.extend(t.shas)
+
+        return cls(
+            head=head,
+            shas=shas,
+            times=np.concatenate([t.times for t in tables]),
+            authors=np.concatenate(authors),
+            author_names=list(author_ids),
+            paths=list(path_ids),
+            commit_idx=np.concatenate(commit_idx),
+            file_idx=np.concatenate(file_idx),
+            added=np.concatenate([t.added for t in tables]),
+            deleted=np.concatenate([t.deleted for t in tables]),
+        )
+
+    def save(self, path: str):
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp,
+            head=np.array(self.head or ""),
+            shas=np.array(self.shas, dtype="U40"),
+            times=self.times,
+            authors=self.authors,
+            author_names=np.array(self.author_names, dtype=str),
+            paths=np.array(self.paths, dtype=str),
+            commit_idx=self.commit_idx,
+            file_idx=self.file_idx,
+            added=self.added,
+            deleted=self.deleted,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ChangeTable":
+        with np.load(path) as data:
+            return cls(
+                head=str(data["head"]) or None,
+                shas=data["shas"].tolist(),
+                times=data["times"],
+                authors=data["authors"],
+                author_names=data["author_names"].tolist(),
+                paths=data["paths"].tolist(),
+                commit_idx=data["commit_idx"],
+                file_idx=data["file_idx"],
+                added=data["added"],
+                deleted=data["deleted"],
+            )
+
+
+def mine_changes(repo: pygit2.Repository, commits: Sequence[pygit2.Commit], head: Optional[str] = None) -> ChangeTable:
+    """
+    Строит таблицу по данным коммитам. Merge- и служебные коммиты пропускаются;
+    строки считаются по patch.line_stats диффа без контекста.
+    """
+    shas: List[str] = []
+    times = array("q")
+    authors = array("i")
+    author_ids: Dict[str, int] = {}
+    path_ids: Dict[str, int] = {}
+    commit_idx, file_idx, added, deleted = array("i"), array("i"), array("i"), array("i")
+
+    for commit in commits:
+        if len(commit.parents) > 1 or is_service_commit(commit):
+            continue
+        if commit.parents:
+            diff = commit.parents[0].tree.diff_to_tree(commit.tree, context_lines=0)
+        else:
+            diff = commit.tree.diff_to_tree(context_lines=0, swap=True)
+
+        ci = len(shas)
+        shas.append(str(commit.id))
+        times.append(commit.commit_time)
+        authors.append(author_ids.setdefault(commit.author.email, len(author_ids)))
+        for patch in diff:
+            path = patch.delta.new_file.path or patch.delta.old_file.path
+            _, n_added, n_deleted = patch.line_stats
+            commit_idx.append(ci)
+            file_idx.append(path_ids.setdefault(path, len(path_ids)))
+            added.append(n_added)
+            deleted.append(n_deleted)
+
+    return ChangeTable(
+        head=head,
+        shas=shas,
+        times=np.frombuffer(times, np.int64).copy(),
+        authors=np.frombuffer(authors, np.int32).copy(),
+        author_names=list(author_ids),
+        paths=list(path_ids),
+        commit_idx=np.frombuffer(commit_idx, np.int32).copy(),
+        file_idx=np.frombuffer(file_idx, np.int32).copy(),
+        added=np.frombuffer(added, np.int32).copy(),
+        deleted=np.frombuffer(deleted, np.int32).copy(),
+    )
+
+
+def _decay(times: np.ndarray, now: float, half_life_days: float) -> np.ndarray:
+    age_days = np.maximum(now - times, 0) / 86400.0
+    return np.exp2(-age_days / half_life_days)
+
+
+def file_hotspots(
+    table: ChangeTable,
+    top_n: int = 20,
+    half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+    now: Optional[float] = None,
+    order_by: str = "score",
+) -> List[Dict]:
+    """
+    Метрики по файлам: changes (число коммитов), churn (добавлено + удалено строк),
+    authors (различные авторы), last_change, score (churn с экспоненциальным
+    затуханием по возрасту коммита, half_life_days — период полураспада).
+    """
+    n_files = len(table.paths)
+    if not len(table) or not n_files:
+        return []
+    now = time.time() if now is None else now
+
+    churn_rows = (table.added + table.deleted).astype(np.float64)
+    row_times = table.times[table.commit_idx]
+    changes = np.bincount(table.file_idx, minlength=n_files)
+    churn = np.bincount(table.file_idx, weights=churn_rows, minlength=n_files)
+    score = np.bincount(table.file_idx, weights=churn_rows * _decay(row_times, now, half_life_days), minlength=n_files)
+
+    last_change = np.zeros(n_files, np.int64)
+    np.maximum.at(last_change, table.file_idx, row_times)
+
+    # пары (файл, автор) без повторов -> число авторов на файл
+    n_authors = max(len(table.author_names), 1)
+    pairs = np.unique(table.file_idx.astype(np.int64) * n_authors + table.authors[table.commit_idx])
+    authors = np.bincount(pairs // n_authors, minlength=n_files)
+
+    metrics = {"score": score, "churn": churn, "changes": changes, "authors": authors, "last_change": last_change}
+    if order_by not in metrics:
+        raise ValueError(f"Unknown metric {order_by!r}, expected one of {sorted(metrics)}")
+    top = np.argsort(-metrics[order_by], kind="stable")[:top_n]
+    return [
+        {
+            "file": table.paths[i],
+            "changes": int(changes[i]),
+            "churn": int(churn[i]),
+            "authors": int(authors[i]),
+            "last_change": int(last_change[i]),
+            "score": round(float(score[i]), 3),
+        }
+        for i in top
+    ]
+
+
+def function_hotspots(
+    table: ChangeTable,
+    range_commits: List[Tuple[str, int, int, List[str]]],
+    half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+    now: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Метрики по функциям по коммитам, которым принадлежат их текущие строки:
+    range_commits — (id сущности, start, end, SHA из blame/line_history).
+    churn по функции в истории не восстановить без blame на каждой версии,
+    поэтому здесь — commits, authors, last_change и затухающий score по коммитам.
+    """
+    now = time.time() if now is None else now
+    sha_idx = {sha: i for i, sha in enumerate(table.shas)}
+    decay = _decay(table.times, now, half_life_days)
+
+    result = []
+    for entity_id, start, end, shas in range_commits:
+        idx = np.array([sha_idx[sha] for sha in shas if sha in sha_idx], np.int64)
+        result.append({
+            "entity_id": entity_id,
+            "start_line": start,
+            "end_line": end,
+            "commits": int(len(idx)),
+            "authors": int(len(np.unique(table.authors[idx]))) if len(idx) else 0,
+            "last_change": int(table.times[idx].max()) if len(idx) else 0,
+            "score": round(float(decay[idx].sum()), 3) if len(idx) else 0.0,
+        })
+    result.sort(key=lambda item: -item["score"])
+    return result
+
+
+_tables: Dict[str, ChangeTable] = {}
+# общий замок защищает только словари; разбор истории идёт под замком своего репозитория
+_tables_lock = threading.Lock()
+_mine_locks: Dict[str, threading.Lock] = {}
+
+
+def load_history(repo: pygit2.Repository, jobs: int = history_miner.MINE_JOBS) -> ChangeTable:
+    """
+    Таблица изменений репозитория, доведённая до HEAD. Сохранённая в .git таблица
+    дополняется только коммитами после её head; если он больше не предок HEAD — строится заново.
+    Новые коммиты разбираются срезами в jobs процессах.
+
+    Пока другой поток дообновляет таблицу этого репозитория, возвращается
+    прошлая таблица; ждут только запросы к репозиторию, для которого таблицы ещё нет.
+    """
+    path = os.path.join(repo.path, TABLE_NAME)
+    head = str(repo.head.target)
+    with _tables_lock:
+        table = _tables.get(path)
+        mine_lock = _mine_locks.setdefault(path, threading.Lock())
+    if table is not None and table.head == head:
+        return table
+    if not mine_lock.acquire(blocking=table is None):
+        return table
+
+    try:
+        with _tables_lock:
+            table = _tables.get(path)
+        if table is None and os.path.exists(path):
+            table = ChangeTable.load(path)
+        if table is not None and table.head == head:
+            with _tables_lock:
+                _tables[path] = table
+            return table
+
+        try:
+            shas = history_miner.commit_range(repo, table.head if table is not None else None)
+        except (KeyError, ValueError, pygit2.GitError):
+            logger.warning(f"Mined head {table.head} is not in HEAD history, rebuilding change table")
+            table = None
+            shas = history_miner.commit_range(repo)
+
+        # срезы идут по порядку, поэтому склейка даёт ту же таблицу, что и обход в один поток
+        parts = [table] if table is not None else []
+        known = len(table.shas) if table is not None else 0
+        parts.extend(history_miner.map_slices(repo, shas, mine_changes, jobs))
+        table = ChangeTable.concat(parts, head=head)
+        table.save(path)
+        with _tables_lock:
+            _tables[path] = table
+        logger.info(f"Change table: +{len(table.shas) - known} commits, {len(table)} changes up to {head[:7]}")
+        return table
+    finally:
+        mine_lock.release()
@@ -0,0 +1,22 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# blame и diff в libgit2 отпускают GIL, поэтому потоков достаточно;
+# у каждого потока свои дескрипторы репозиториев (gitmodule.repo_pool)
+GIT_WORKERS = int(os.getenv("GIT_WORKERS", "4"))
+
+git_executor = ThreadPoolExecutor(max_workers=GIT_WORKERS, thread_name_prefix="git")
+
+
+async def run_git(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Выполняет блокирующую работу с pygit2 в пуле git_executor, не занимая event loop.
+    Одновременно идёт не больше GIT_WORKERS задач, остальные ждут в очереди пула.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(git_executor, partial(fn, *args, **kwargs))
@@ -1,8 +1,8 @@
 import streamlit as st
 import requests
+import json
 from st_link_analysis import st_link_analysis, NodeStyle, EdgeStyle
 from pydantic import BaseModel
-from typing import Optional
 
 st.set_page_config(page_title="CoSE-раскладка графа", layout="wide")
 st.title("📊 Демонстрация CoSE-раскладки Cytoscape.js")
@@ -13,22 +13,31 @@ class FunctionAnalysisRequest(BaseModel):
     start_line: int
     end_line: int
 
-# Функция для отправки запроса на анализ
-def analyze_function(file_path: str, start_line: int, end_line: int) -> Optional[str]:
-    try:
-        response = requests.post(
-            "http://localhost:8000/git-analysis/analyze-function",
-            json={
-                "file_path": file_path,
-                "start_line": start_line,
-                "end_line": end_line
-            }
-        )
+# Анализ функции: отдаёт куски ответа модели по мере генерации (SSE)
+def stream_function_analysis(file_path: str, start_line: int, end_line: int):
+    with requests.post(
+        "http://localhost:8000/git-analysis/analyze-function/stream",
+        json={
+            "file_path": file_path,
+            "start_line": start_line,
+            "end_line": end_line
+        },
+        stream=True,
+    ) as response:
         response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        st.error(f"Ошибка при анализе функции: {str(e)}")
-        return None
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "error":
+                    raise RuntimeError(data)
+                if event == "done":
+                    return
+                yield data
 
 # Примерная структура
 example_elements = {
@@ -80,10 +89,11 @@ end_line = st.sidebar.number_input("Конечная строка", min_value=1,
 
 if st.sidebar.button("Проанализировать функцию"):
     if selected_file and start_line and end_line:
-        result = analyze_function(selected_file, start_line, end_line)
-        if result:
+        try:
+            st.sidebar.write_stream(stream_function_analysis(selected_file, start_line, end_line))
             st.sidebar.success("Анализ завершен")
-            st.sidebar.json(result)
+        except Exception as e:
+            st.sidebar.error(f"Ошибка при анализе функции: {str(e)}")
     else:
         st.sidebar.error("Пожалуйста, заполните все поля")
 